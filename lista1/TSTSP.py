@@ -1,68 +1,724 @@
 # Autor: Dr inż. Piotr Syga
 # Źródło: https://syga.kft.pwr.edu.pl/courses/siiiw/TSTSP.py
+# Kod został zmodyfikowany: koszt zamiany dwóch miast jest liczony jako różnica kilku krawędzi,
+# dla całego sąsiedztwa naraz (NumPy), a lista tabu jest macierzą iteracji, do której ruch jest zabroniony.
+# Dla dużych instancji są ruchy 2-opt i Or-opt ograniczone do list k najbliższych sąsiadów.
+# Odległości są dostarczane przez obiekt (macierz float32, macierz w pliku lub liczone na żądanie).
+# Można uruchomić kilka przeszukiwań równolegle, dzielących się najlepszymi trasami.
+# solve przerywa przeszukiwanie w terminie, raportuje postęp i zapisuje stan, od którego można je wznowić.
+import multiprocessing
+import os
+import pickle
 import random
 import math
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 
-n_cities = 100
-n_dimensions = 7
-max_iterations = math.ceil(1.1*(n_cities**2))
-turns_improved = 0
-improve_thresh=2*math.floor(math.sqrt(max_iterations))
-tabu_list = []
-tabu_tenure = n_cities
-
-
-
-def distance(city1, city2):
-    return math.sqrt(sum([(city1[i]-city2[i])**2 for i in range(n_dimensions)]))
-
-cities = [[random.randint(0, 100) for j in range(n_dimensions)] for i in range(n_cities)]
-distances = [[distance(cities[i], cities[j]) for j in range(n_cities)] for i in range(n_cities)]
-
-total=0
-for i in range(n_cities):
-        for j in range(n_cities):
-            total += distances[i][j]
-
-aspiration_criteria = (total/(n_cities**2))*2.2
-
-current_solution = list(range(n_cities))
-random.shuffle(current_solution)
-best_solution = current_solution[:]
-best_solution_cost = sum([distances[current_solution[i]][current_solution[(i+1)%n_cities]] for i in range(n_cities)])
-
-for iteration in range(max_iterations):
-    if turns_improved>improve_thresh:
-        break
-    best_neighbor = None
-    best_neighbor_cost = float('inf')
-    coordA, coordB = 0, 0
-    for i in range(n_cities):
-        for j in range(i+1, n_cities):
-            neighbor = current_solution[:]
-            neighbor[i], neighbor[j] = neighbor[j], neighbor[i]
-            neighbor_cost = sum([distances[neighbor[i]][neighbor[(i+1)%n_cities]] for i in range(n_cities)])
-            if (i,j) not in tabu_list or neighbor_cost < aspiration_criteria:
-                if neighbor_cost < best_neighbor_cost:
-                    best_neighbor = neighbor[:]
-                    best_neighbor_cost = neighbor_cost
-                    coordA, coordB = i,j
-        tabu_list.append((coordA, coordB))    
-    if best_neighbor is not None:
-        current_solution = best_neighbor[:]
-        tabu_list.append((coordA, coordB))
-
-        if len(tabu_list) > tabu_tenure:
-            tabu_list.pop(0)
-        if best_neighbor_cost < best_solution_cost:
-            best_solution = best_neighbor[:]
-            best_solution_cost = best_neighbor_cost
-            turns_improved=0
+# Distances between cities at index a and b, elementwise (broadcast)
+def pair_distances(cities, a, b):
+    return np.sqrt(((cities[a] - cities[b]) ** 2).sum(axis=-1))
+
+# Distances from the cities rows to all cities, squared - squared norms of all cities
+def row_distances(cities, rows, squared):
+    block = np.sqrt(np.maximum(squared[rows, None] + squared[None, :] - 2 * cities[rows] @ cities.T, 0))
+    block[np.arange(len(rows)), rows] = 0
+    return block
+
+# Distance providers. The solvers only use this interface:
+# len(distances), distances.distance(a, b) - one distance, distances.pairs(a, b) - elementwise for arrays of cities,
+# distances.block(rows, columns=None) - rows of the matrix, only the given columns if columns isn't None.
+# pairs and block return float64, so costs accumulated from deltas don't drift with a float32 matrix.
+
+# Whole matrix, in memory or memory-mapped from a .npy file
+class DenseDistances:
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    # Built a block of rows at a time, without float64 n x n temporaries
+    @classmethod
+    def from_cities(cls, cities, dtype=np.float32, block=1024):
+        cities = np.asarray(cities, dtype=np.float64)
+        matrix = np.empty((len(cities), len(cities)), dtype=dtype)
+        cls.fill(matrix, cities, block)
+        return cls(matrix)
+
+    # Writes the matrix to a .npy file at path and maps it read-only
+    @classmethod
+    def create(cls, path, cities, dtype=np.float32, block=1024):
+        cities = np.asarray(cities, dtype=np.float64)
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(cities), len(cities)))
+        cls.fill(matrix, cities, block)
+        matrix.flush()
+        del matrix
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path):
+        return cls(np.load(path, mmap_mode='r'))
+
+    @staticmethod
+    def fill(matrix, cities, block):
+        squared = (cities ** 2).sum(axis=1)
+        for start in range(0, len(cities), block):
+            rows = np.arange(start, min(start + block, len(cities)))
+            matrix[rows] = row_distances(cities, rows, squared)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def distance(self, a, b):
+        return float(self.matrix[a, b])
+
+    def pairs(self, a, b):
+        return self.matrix[a, b].astype(np.float64)
+
+    def block(self, rows, columns=None):
+        rows = self.matrix[rows]
+        return (rows if columns is None else rows[:, columns]).astype(np.float64)
+
+# Distances computed from the coordinates when needed, the last cache_rows rows returned by block are kept
+class LazyDistances:
+    def __init__(self, cities, cache_rows=256):
+        self.cities = np.asarray(cities, dtype=np.float64)
+        self.coords = [tuple(city) for city in self.cities.tolist()]
+        self.squared = (self.cities ** 2).sum(axis=1)
+        self.cache = OrderedDict()
+        self.cache_rows = cache_rows
+
+    def __len__(self):
+        return len(self.cities)
+
+    def distance(self, a, b):
+        return math.dist(self.coords[a], self.coords[b])
+
+    def pairs(self, a, b):
+        return pair_distances(self.cities, a, b)
+
+    # Blocks bigger than the cache are computed directly, so they don't evict the hot rows
+    def block(self, rows, columns=None):
+        rows = np.asarray(rows)
+        if len(rows) > self.cache_rows:
+            result = row_distances(self.cities, rows, self.squared)
+        else:
+            missing = [row for row in dict.fromkeys(rows.tolist()) if row not in self.cache]
+            if missing:
+                for row, values in zip(missing, row_distances(self.cities, np.array(missing), self.squared)):
+                    self.cache[row] = values
+            for row in rows.tolist():
+                self.cache.move_to_end(row)
+            while len(self.cache) > self.cache_rows:
+                self.cache.popitem(last=False)
+            result = np.stack([self.cache[row] for row in rows.tolist()]) if len(rows) else np.empty((0, len(self)))
+        return result if columns is None else result[:, columns]
+
+# Average of all n x n distances (with the zero diagonal), summed a block of rows at a time,
+# or estimated from sample random pairs
+def average_distance(distances, sample=None, rng=None, block=1024):
+    n = len(distances)
+    if sample is not None:
+        rng = rng or np.random.default_rng()
+        return float(distances.pairs(rng.integers(n, size=sample), rng.integers(n, size=sample)).mean())
+    total = 0.0
+    for start in range(0, n, block):
+        total += distances.block(np.arange(start, min(start + block, n))).sum()
+    return total / n ** 2
+
+def tour_cost(tour, distances):
+    tour = np.asarray(tour)
+    return float(distances.pairs(tour, np.roll(tour, -1)).sum())
+
+# Change of the tour cost after swapping the cities at positions i and j, for all i < j at once
+# (the lower triangle and the diagonal are not valid moves). Distances have to be symmetric.
+# Swapping changes only the edges around both positions: four edges on each side,
+# or three when the positions are next to each other (also the last and the first one).
+def swap_deltas(tour, distances):
+    n = len(tour)
+    if n < 4:
+        # Every tour of at most 3 cities has the same cost
+        return np.zeros((n, n))
+    city = np.asarray(tour)
+    prev = np.roll(city, 1)
+    following = np.roll(city, -1)
+    removed = distances.pairs(prev, city) + distances.pairs(city, following)
+    # to_prev[i, j] = d(prev of i, city at j), to_next[i, j] = d(next of i, city at j)
+    to_prev = distances.block(prev, city)
+    to_next = distances.block(following, city)
+    deltas = to_prev + to_next + to_prev.T + to_next.T - removed[:, None] - removed[None, :]
+
+    i = np.arange(n - 1)
+    j = i + 1
+    deltas[i, j] = distances.pairs(prev[i], city[j]) + distances.pairs(city[i], following[j]) - distances.pairs(prev[i], city[i]) - distances.pairs(city[j], following[j])
+    deltas[0, n - 1] = distances.distance(prev[n - 1], city[0]) + distances.distance(city[n - 1], following[0]) - distances.distance(prev[n - 1], city[n - 1]) - distances.distance(city[0], following[0])
+    return deltas
+
+# Everything needed to continue a tabu search: the current and the best tour with their costs,
+# tabu_until (a matrix for swaps, a vector of cities for candidate moves), the iteration counters,
+# whether the candidate descent is finished, its queue of cities still to check (None before it starts)
+# and the state of the random generator (set by solve). moves counts applied moves of both phases.
+class SearchState:
+    def __init__(self, method, current, current_cost, tabu_until, descended=True):
+        self.method = method
+        self.current = current
+        self.current_cost = current_cost
+        self.best = current.copy()
+        self.best_cost = current_cost
+        self.tabu_until = tabu_until
+        self.iteration = 0
+        self.turns_improved = 0
+        self.descended = descended
+        self.queue = None
+        self.moves = 0
+        self.rng_state = None
+
+# State at the start tour, or a random one
+def initial_state(method, distances, start=None, rng=random):
+    n_cities = len(distances)
+    if start is None:
+        start = list(range(n_cities))
+        rng.shuffle(start)
+    start = np.array(start, dtype=np.int64)
+    if method == 'swap':
+        return SearchState(method, start, tour_cost(start, distances), np.zeros((n_cities, n_cities), dtype=np.int64))
+    return SearchState(method, start, tour_cost(start, distances), np.zeros(n_cities, dtype=np.int64), descended=False)
+
+# Tabu search over swaps of two positions of the tour
+# A swap of positions (i, j) is tabu until iteration tabu_until[i, j], unless it gives a tour cheaper than aspiration_criteria.
+# Stops after max_iterations, after improve_thresh iterations without a better solution or at deadline (time.monotonic()).
+# Starts from the start tour, or a random one, or continues state. callback(state) is called after every iteration.
+# Returns the best tour and its cost.
+def tabu_search(distances, max_iterations, improve_thresh, tabu_tenure, aspiration_criteria, rng=random, verbose=True,
+                start=None, deadline=None, state=None, callback=None):
+    n_cities = len(distances)
+    if state is None:
+        state = initial_state('swap', distances, start, rng)
+    current_solution = state.current
+    tabu_until = state.tabu_until
+    valid = np.triu(np.ones((n_cities, n_cities), dtype=bool), k=1)
+
+    while state.iteration < max_iterations:
+        iteration = state.iteration
+        if state.turns_improved>improve_thresh or (deadline is not None and time.monotonic() >= deadline):
+            break
+        deltas = swap_deltas(current_solution, distances)
+        allowed = valid & ((tabu_until <= iteration) | (state.current_cost + deltas < aspiration_criteria))
+        if allowed.any():
+            move = np.argmin(np.where(allowed, deltas, np.inf))
+            coordA, coordB = divmod(int(move), n_cities)
+            current_solution[coordA], current_solution[coordB] = current_solution[coordB], current_solution[coordA]
+            state.current_cost += deltas[coordA, coordB]
+            state.moves += 1
+            tabu_until[coordA, coordB] = iteration + tabu_tenure + 1
+
+            if state.current_cost < state.best_cost:
+                state.best = current_solution.copy()
+                state.best_cost = state.current_cost
+                state.turns_improved=0
+            else:
+                state.turns_improved=state.turns_improved+1
+
+        if verbose:
+            print("Iteration {}: Best solution cost = {}".format(iteration, state.best_cost))
+        state.iteration += 1
+        if callback is not None:
+            callback(state)
+
+    return state.best.tolist(), state.best_cost
+
+# Large instances: 2-opt and Or-opt moves restricted to candidate lists (k nearest cities),
+# with LazyDistances no n x n matrix is needed.
+
+# k nearest other cities of every city, sorted by distance, computed for blocks of rows at a time
+def nearest_neighbors(distances, k, block=1024):
+    n = len(distances)
+    k = min(k, n - 1)
+    result = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start + block, n))
+        row_block = distances.block(rows)
+        row_block[np.arange(len(rows)), rows] = np.inf
+        nearest = np.argpartition(row_block, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(row_block, nearest, axis=1), axis=1)
+        result[rows] = np.take_along_axis(nearest, order, axis=1)
+    return result
+
+# Tour as an array of cities (order) and the position of every city in it
+class Tour:
+    def __init__(self, order):
+        self.order = np.array(order, dtype=np.int64)
+        self.position = np.empty_like(self.order)
+        self.position[self.order] = np.arange(len(self.order))
+
+    def __len__(self):
+        return len(self.order)
+
+    # Successor and predecessor of every city
+    def successors(self):
+        return np.roll(self.order, -1)[self.position]
+
+    def predecessors(self):
+        return np.roll(self.order, 1)[self.position]
+
+    def next_city(self, city):
+        return int(self.order[(self.position[city] + 1) % len(self.order)])
+
+    def prev_city(self, city):
+        return int(self.order[self.position[city] - 1])
+
+    # Reverses positions i..j (i <= j). Reversing the rest of the cycle gives the same tour,
+    # so the shorter of the two is reversed.
+    def reverse(self, i, j):
+        n = len(self.order)
+        if 2 * (j - i + 1) > n:
+            index = np.arange(j + 1, i + n) % n
         else:
-            turns_improved=turns_improved+1 
+            index = np.arange(i, j + 1)
+        self.order[index] = self.order[index[::-1]]
+        self.position[self.order[index]] = index
+
+    # 2-opt: replaces edges (a, next a) and (c, next c) with (a, c) and (next a, next c)
+    def two_opt_next(self, a, c):
+        i, j = self.position[a], self.position[c]
+        if i < j:
+            self.reverse(i + 1, j)
+        else:
+            self.reverse(j + 1, i)
+
+    # 2-opt: replaces edges (prev a, a) and (prev c, c) with (a, c) and (prev a, prev c)
+    def two_opt_prev(self, a, c):
+        i, j = self.position[a], self.position[c]
+        if i < j:
+            self.reverse(i, j - 1)
+        else:
+            self.reverse(j, i - 1)
+
+    # Or-opt: moves length cities starting at city first to between city after and its successor,
+    # in reversed order if reverse is set
+    def move_segment(self, first, length, after, reverse):
+        n = len(self.order)
+        order = np.roll(self.order, -int(self.position[first]))
+        segment = order[:length][::-1] if reverse else order[:length]
+        insert = (self.position[after] - self.position[first]) % n + 1 - length
+        rest = order[length:]
+        self.order = np.concatenate((rest[:insert], segment, rest[insert:]))
+        self.position[self.order] = np.arange(n)
+
+# First improvement descent with 2-opt and Or-opt (segments of 1 to 3 cities) over candidate lists.
+# Cities whose edges changed are queued again ("don't look bits"), the descent ends when the queue is empty.
+# Returns the change of the tour cost. Also stops at deadline, leaving the tour improved but not a local optimum
+# and the cities still to check in queue, a later call with the same queue continues exactly where it stopped.
+# callback(change of the cost so far, applied moves) is called after every callback_every checked cities and at the end.
+def candidate_descent(tour, distances, neighbors, neighbor_distances, queue=None, deadline=None, callback=None, callback_every=64):
+    n = len(tour)
+    if queue is None:
+        queue = deque(tour.order.tolist())
+    queued = np.zeros(n, dtype=bool)
+    queued[list(queue)] = True
+    total = 0.0
+    moves = 0
+    checked = 0
+
+    def push(*cities):
+        for city in cities:
+            if not queued[city]:
+                queued[city] = True
+                queue.append(city)
+
+    while queue:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        a = queue.popleft()
+        queued[a] = False
+        checked += 1
+        if callback is not None and checked % callback_every == 0:
+            callback(total, moves)
+        delta, move = best_improvement(tour, distances, neighbors, neighbor_distances, a)
+        if move is None:
+            continue
+        kind = move[0]
+        if kind == 'next':
+            c = move[1]
+            a1, c1 = tour.next_city(a), tour.next_city(c)
+            tour.two_opt_next(a, c)
+            push(a, a1, c, c1)
+        elif kind == 'prev':
+            c = move[1]
+            a0, c0 = tour.prev_city(a), tour.prev_city(c)
+            tour.two_opt_prev(a, c)
+            push(a, a0, c, c0)
+        else:
+            _, length, after, reverse = move
+            last = int(tour.order[(tour.position[a] + length - 1) % n])
+            push(a, last, tour.prev_city(a), tour.next_city(last), after, tour.next_city(after))
+            tour.move_segment(a, length, after, reverse)
+        total += delta
+        moves += 1
+    if callback is not None:
+        callback(total, moves)
+    return total
+
+# First improving 2-opt or Or-opt move around city a, as (delta, move) or (0, None)
+def best_improvement(tour, distances, neighbors, neighbor_distances, a):
+    n = len(tour)
+    dist = distances.distance
+    position = tour.position
+    order = tour.order
+    a1, a0 = tour.next_city(a), tour.prev_city(a)
+    d_next = dist(a, a1)
+    d_prev = dist(a0, a)
+    for c, d_ac in zip(neighbors[a], neighbor_distances[a]):
+        if d_ac >= d_next and d_ac >= d_prev:
+            break
+        c = int(c)
+        c1, c0 = tour.next_city(c), tour.prev_city(c)
+        if d_ac < d_next and c != a1 and c1 != a:
+            delta = d_ac + dist(a1, c1) - d_next - dist(c, c1)
+            if delta < -1e-9:
+                return delta, ('next', c)
+        if d_ac < d_prev and c != a0 and c0 != a:
+            delta = d_ac + dist(a0, c0) - d_prev - dist(c0, c)
+            if delta < -1e-9:
+                return delta, ('prev', c)
+
+    i = position[a]
+    for length in (1, 2, 3):
+        if length > n - 3:
+            break
+        last = int(order[(i + length - 1) % n])
+        following = tour.next_city(last)
+        gain = d_prev + dist(last, following) - dist(a0, following)
+        for c, d_ac in zip(neighbors[a], neighbor_distances[a]):
+            if d_ac >= gain:
+                break
+            c = int(c)
+            if (position[c] - i) % n < length:
+                continue
+            c1, c0 = tour.next_city(c), tour.prev_city(c)
+            if (position[c1] - i) % n >= length:
+                delta = d_ac + dist(last, c1) - dist(c, c1) - gain
+                if delta < -1e-9:
+                    return delta, ('move', length, c, False)
+            if (position[c0] - i) % n >= length:
+                delta = d_ac + dist(c0, last) - dist(c0, c) - gain
+                if delta < -1e-9:
+                    return delta, ('move', length, c0, True)
+    return 0.0, None
+
+# Deltas of every candidate move of the tour, vectorized: 2-opt in both directions and Or-opt of 1 to 3 cities
+# inserted after or before a candidate. Returns (deltas, kinds, first city, candidate) of all moves,
+# invalid moves have delta inf. kinds: 0 - 2-opt next, 1 - 2-opt prev, 2 + 2 * (length - 1) + reversed - Or-opt.
+def candidate_deltas(tour, distances, neighbors, neighbor_distances):
+    n, k = neighbors.shape
+    order, position = tour.order, tour.position
+    succ, pred = tour.successors(), tour.predecessors()
+    succ_len = distances.pairs(np.arange(n), succ)
+    pred_len = succ_len[pred]
+    A = np.repeat(np.arange(n), k)
+    C = neighbors.ravel()
+    d_ac = neighbor_distances.ravel()
+
+    deltas, kinds = [], []
+    delta = d_ac + distances.pairs(succ[A], succ[C]) - succ_len[A] - succ_len[C]
+    deltas.append(np.where((C == succ[A]) | (succ[C] == A), np.inf, delta))
+    delta = d_ac + distances.pairs(pred[A], pred[C]) - pred_len[A] - pred_len[C]
+    deltas.append(np.where((C == pred[A]) | (pred[C] == A), np.inf, delta))
+    kinds += [0, 1]
+
+    i = position[A]
+    for length in (1, 2, 3):
+        if length > n - 3:
+            break
+        last = order[(position + length - 1) % n]
+        gain = (pred_len + succ_len[last] - distances.pairs(pred, succ[last]))[A]
+        last = last[A]
+        in_segment = lambda city: (position[city] - i) % n < length
+        blocked = in_segment(C)
+        delta = d_ac + distances.pairs(last, succ[C]) - succ_len[C] - gain
+        deltas.append(np.where(blocked | in_segment(succ[C]), np.inf, delta))
+        delta = d_ac + distances.pairs(pred[C], last) - pred_len[C] - gain
+        deltas.append(np.where(blocked | in_segment(pred[C]), np.inf, delta))
+        kinds += [2 + 2 * (length - 1), 3 + 2 * (length - 1)]
+    return deltas, kinds, A, C
+
+# Tabu search over candidate moves for large instances
+# Starts from the start tour (or a random one) improved by candidate_descent, then max_iterations times applies the best move
+# that isn't tabu: a move is tabu when one of its two cities was part of a move in the last tabu_tenure iterations,
+# unless it leads to a tour better than the best one (aspiration).
+# Stops early after improve_thresh iterations without a better solution or at deadline (time.monotonic()).
+# neighbors - precomputed nearest_neighbors, when the search is run many times.
+# state and callback as in tabu_search. Returns the best tour and its cost.
+def candidate_tabu_search(distances, max_iterations, improve_thresh, tabu_tenure, k=8, rng=random, verbose=True,
+                          start=None, deadline=None, neighbors=None, state=None, callback=None):
+    n_cities = len(distances)
+    if neighbors is None:
+        neighbors = nearest_neighbors(distances, k)
+    neighbor_distances = distances.pairs(np.arange(n_cities)[:, None], neighbors)
+    neighbor_lists = neighbors.tolist()
+    neighbor_distance_lists = neighbor_distances.tolist()
+
+    if state is None:
+        state = initial_state('candidates', distances, start, rng)
+    tour = Tour(state.current)
+    if not state.descended:
+        if state.queue is None:
+            state.queue = deque(tour.order.tolist())
+        start_cost, start_moves = state.current_cost, state.moves
+
+        # Keeps the state in step with the descent, so the callback can checkpoint it
+        def descent_callback(total, moves):
+            state.current = tour.order
+            state.current_cost = start_cost + total
+            state.moves = start_moves + moves
+            if state.current_cost < state.best_cost - 1e-9:
+                state.best = tour.order.copy()
+                state.best_cost = state.current_cost
+            if callback is not None:
+                callback(state)
+
+        candidate_descent(tour, distances, neighbor_lists, neighbor_distance_lists, state.queue, deadline, descent_callback)
+        state.descended = not state.queue
+        if state.descended:
+            state.queue = None
+        if verbose:
+            print("Descent: cost = {}".format(state.current_cost))
+    tabu_until = state.tabu_until
+
+    while state.iteration < max_iterations and state.descended:
+        iteration = state.iteration
+        if state.turns_improved>improve_thresh or n_cities < 5 or (deadline is not None and time.monotonic() >= deadline):
+            break
+        deltas, kinds, A, C = candidate_deltas(tour, distances, neighbors, neighbor_distances)
+        tabu = (tabu_until[A] > iteration) | (tabu_until[C] > iteration)
+        best_move, best_delta, best_kind = None, np.inf, None
+        for kind, delta in zip(kinds, deltas):
+            allowed = np.where(tabu & (state.current_cost + delta >= state.best_cost - 1e-9), np.inf, delta)
+            move = int(np.argmin(allowed))
+            if allowed[move] < best_delta:
+                best_move, best_delta, best_kind = move, allowed[move], kind
+        if best_move is None:
+            break
+        a, c = int(A[best_move]), int(C[best_move])
+        if best_kind == 0:
+            tour.two_opt_next(a, c)
+        elif best_kind == 1:
+            tour.two_opt_prev(a, c)
+        else:
+            length, reverse = (best_kind - 2) // 2 + 1, (best_kind - 2) % 2 == 1
+            tour.move_segment(a, length, tour.prev_city(c) if reverse else c, reverse)
+        state.current = tour.order
+        state.current_cost += best_delta
+        state.moves += 1
+        tabu_until[a] = tabu_until[c] = iteration + tabu_tenure + 1
+
+        if state.current_cost < state.best_cost - 1e-9:
+            state.best = tour.order.copy()
+            state.best_cost = state.current_cost
+            state.turns_improved=0
+        else:
+            state.turns_improved=state.turns_improved+1
+
+        if verbose:
+            print("Iteration {}: Best solution cost = {}".format(iteration, state.best_cost))
+        state.iteration += 1
+        if callback is not None:
+            callback(state)
+
+    return state.best.tolist(), tour_cost(state.best, distances)
+
+solvers = {'swap': tabu_search, 'candidates': candidate_tabu_search}
+
+# Double bridge kick: cuts the tour into A B C D and reconnects it as A C B D,
+# a change that 2-opt and Or-opt moves can't easily undo
+def double_bridge(tour, rng=random):
+    tour = list(tour)
+    if len(tour) < 8:
+        rng.shuffle(tour)
+        return tour
+    i, j, k = sorted(rng.sample(range(1, len(tour)), 3))
+    return tour[:i] + tour[j:k] + tour[i:j] + tour[k:]
+
+# Adds a tour to the elite pool (a list of (cost, tour), best first), keeping elite_size different tours
+def publish_elite(elite, lock, cost, tour, elite_size):
+    with lock:
+        entries = list(elite)
+        if any(abs(entry_cost - cost) < 1e-9 for entry_cost, _ in entries):
+            return
+        entries.append((cost, tour))
+        entries.sort(key=lambda entry: entry[0])
+        elite[:] = entries[:elite_size]
+
+def init_search_worker(distances, method, search_args, elite, lock, elite_size, restart_probability, deadline,
+                       publish_interval, restart_interval):
+    global worker_distances, worker_method, worker_search_args, worker_elite, worker_lock, worker_elite_size
+    global worker_restart_probability, worker_deadline, worker_publish_interval, worker_restart_interval
+    worker_distances = distances
+    worker_method = method
+    worker_search_args = search_args
+    worker_elite = elite
+    worker_lock = lock
+    worker_elite_size = elite_size
+    worker_restart_probability = restart_probability
+    worker_deadline = deadline
+    worker_publish_interval = publish_interval
+    worker_restart_interval = restart_interval
+
+# Repeats searches until the deadline. Every search is cut after restart_interval seconds and its best tour is
+# also published to the elite pool every publish_interval seconds while it runs (a single search with large
+# max_iterations can take the whole budget). The next search starts from a kicked elite tour
+# (with restart_probability) or a new random tour. Returns the best (cost, tour) of this worker.
+def worker_search(seed):
+    rng = random.Random(seed)
+    best = (float('inf'), None)
+    start = None
+    published = time.monotonic()
+
+    def publish(state):
+        nonlocal published
+        now = time.monotonic()
+        if now - published >= worker_publish_interval:
+            publish_elite(worker_elite, worker_lock, float(state.best_cost), state.best.tolist(), worker_elite_size)
+            published = now
+
+    while time.monotonic() < worker_deadline:
+        deadline = min(worker_deadline, time.monotonic() + worker_restart_interval)
+        tour, cost = solvers[worker_method](worker_distances, **worker_search_args, rng=rng, verbose=False,
+                                            start=start, deadline=deadline, callback=publish)
+        best = min(best, (cost, tour), key=lambda entry: entry[0])
+        publish_elite(worker_elite, worker_lock, cost, tour, worker_elite_size)
+        published = time.monotonic()
+        elite = list(worker_elite)
+        start = double_bridge(rng.choice(elite)[1], rng) if elite and rng.random() < worker_restart_probability else None
+    return best
+
+# Runs independent tabu searches (method 'swap' or 'candidates') in workers processes for time_budget seconds.
+# Worker i is seeded with seed + i, they share an elite pool of the elite_size best tours and restart from it.
+# search_args are passed to the solver (max_iterations, improve_thresh, tabu_tenure, ...). Workers publish their
+# best tour every publish_interval seconds and restart at least every restart_interval seconds
+# (default a tenth of the budget). workers=1 searches in this process. Returns the best tour and its cost.
+def parallel_tabu_search(distances, time_budget, search_args, method='candidates', workers=None, seed=None,
+                         elite_size=8, restart_probability=0.8, publish_interval=None, restart_interval=None):
+    deadline = time.monotonic() + time_budget
+    if restart_interval is None:
+        restart_interval = time_budget / 10
+    if publish_interval is None:
+        publish_interval = restart_interval / 4
+    if seed is None:
+        seed = random.randrange(2**32)
+    workers = workers or multiprocessing.cpu_count()
+    search_args = dict(search_args)
+    if method == 'candidates' and 'neighbors' not in search_args:
+        search_args['neighbors'] = nearest_neighbors(distances, search_args.get('k', 8))
+    if workers == 1:
+        elite = []
+        init_search_worker(distances, method, search_args, elite, threading.Lock(), elite_size, restart_probability, deadline,
+                           publish_interval, restart_interval)
+        cost, tour = worker_search(seed)
+        return tour, cost
+
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with context.Manager() as manager:
+        elite = manager.list()
+        initargs = (distances, method, search_args, elite, manager.Lock(), elite_size, restart_probability, deadline,
+                    publish_interval, restart_interval)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_search_worker, initargs=initargs) as pool:
+            results = list(pool.map(worker_search, [seed + i for i in range(workers)]))
+    cost, tour = min(results, key=lambda entry: entry[0])
+    return tour, cost
+
+# Writes the state to path through a temporary file, a preempted write never leaves a broken checkpoint
+def save_checkpoint(path, state):
+    temp_path = str(path) + '.tmp'
+    with open(temp_path, 'wb') as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+def load_checkpoint(path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+def print_progress(event):
+    print("Iteration {iteration}: best cost = {best_cost:.3f}, current cost = {current_cost:.3f}, {moves_per_second:.1f} moves/s".format(**event))
+
+# Library entry point: one tabu search (method 'swap' or 'candidates', search_args as for the solver)
+# until its stopping rules or the deadline (a time.monotonic() value, or time_budget seconds from now).
+# progress(event) gets a dict with iteration (of the tabu phase), best_cost, current_cost and moves_per_second,
+# at most every progress_interval seconds, None turns it off.
+# With checkpoint (a file path) the state is saved every checkpoint_interval seconds and at the end,
+# and a run is continued from an existing checkpoint. Returns the best tour and its cost.
+def solve(distances, search_args, method='candidates', deadline=None, time_budget=None, seed=None,
+          progress=print_progress, progress_interval=1.0, checkpoint=None, checkpoint_interval=60.0):
+    if time_budget is not None:
+        deadline = min(deadline or math.inf, time.monotonic() + time_budget)
+    rng = random.Random(seed)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+        if state.method != method or len(state.current) != len(distances):
+            raise ValueError("Checkpoint {} is a {} search of {} cities".format(checkpoint, state.method, len(state.current)))
+        rng.setstate(state.rng_state)
+    else:
+        state = initial_state(method, distances, rng=rng)
+
+    last_progress = last_checkpoint = time.monotonic()
+    last_moves = state.moves
+
+    # Called after every tabu iteration and periodically during the candidate descent
+    def callback(state):
+        nonlocal last_progress, last_checkpoint, last_moves
+        now = time.monotonic()
+        if progress is not None and now - last_progress >= progress_interval:
+            progress({'iteration': state.iteration, 'best_cost': float(state.best_cost), 'current_cost': float(state.current_cost),
+                      'moves_per_second': (state.moves - last_moves) / (now - last_progress)})
+            last_progress, last_moves = now, state.moves
+        if checkpoint is not None and now - last_checkpoint >= checkpoint_interval:
+            state.rng_state = rng.getstate()
+            save_checkpoint(checkpoint, state)
+            last_checkpoint = now
+
+    tour, cost = solvers[method](distances, **search_args, rng=rng, verbose=False, deadline=deadline,
+                                 state=state, callback=callback)
+    if checkpoint is not None:
+        state.rng_state = rng.getstate()
+        save_checkpoint(checkpoint, state)
+    return tour, cost
+
+if __name__ == '__main__':
+    # Usage: python TSTSP.py [n_cities] [swap|candidates] [dense|memmap|lazy] [seconds] [workers]
+    # With workers, parallel_tabu_search runs for seconds, otherwise solve runs with seconds as the time budget
+    n_cities = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    method = sys.argv[2] if len(sys.argv) > 2 else 'swap'
+    provider = sys.argv[3] if len(sys.argv) > 3 else ('lazy' if method == 'candidates' else 'dense')
+    seconds = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    n_dimensions = 7
+    max_iterations = math.ceil(1.1*(n_cities**2))
+    improve_thresh=2*math.floor(math.sqrt(max_iterations))
+    tabu_tenure = n_cities
+
+    cities = [[random.randint(0, 100) for j in range(n_dimensions)] for i in range(n_cities)]
+    directory = tempfile.TemporaryDirectory()
+    if provider == 'memmap':
+        distances = DenseDistances.create(directory.name + '/distances.npy', cities)
+    elif provider == 'lazy':
+        distances = LazyDistances(cities)
+    else:
+        distances = DenseDistances.from_cities(cities)
 
-    print("Iteration {}: Best solution cost = {}".format(iteration, best_solution_cost))
+    if method == 'candidates':
+        search_args = {'max_iterations': max_iterations, 'improve_thresh': improve_thresh, 'tabu_tenure': min(tabu_tenure, 20)}
+    else:
+        # Exact average for small instances, sampled for big ones
+        aspiration_criteria = average_distance(distances, sample=None if n_cities <= 5000 else 10**6)*2.2
+        search_args = {'max_iterations': max_iterations, 'improve_thresh': improve_thresh, 'tabu_tenure': tabu_tenure,
+                       'aspiration_criteria': aspiration_criteria}
+    if workers is None:
+        best_solution, best_solution_cost = solve(distances, search_args, method, time_budget=seconds)
+    else:
+        best_solution, best_solution_cost = parallel_tabu_search(distances, seconds, search_args, method, workers)
 
-print("Best solution: {}".format(best_solution))
-print("Best solution cost: {}".format(best_solution_cost))
\ No newline at end of file
+    print("Best solution: {}".format(best_solution))
+    print("Best solution cost: {}".format(best_solution_cost))
@@ -2,6 +2,10 @@
 # Źródło: https://syga.kft.pwr.edu.pl/courses/siiiw/astar.py
 import heapq
 import math
+import random
+import sys
+from timeit import default_timer as timer
+import numpy as np
 
 def astar(start, goal, neighbors_fn, heuristic_fn):
     front = [(0, start)]
@@ -54,6 +58,88 @@ def cosine_distance(a, b):
 def chebyshev_distance(a, b):
     return max(abs(x - y) for x, y in zip(a, b))
 
+# Heuristics evaluated for many points at once: goal is a coordinate vector, points has one row per node
+def manhattan_distances(goal, points):
+    return np.abs(points - goal).sum(axis=1)
+
+def euclidean_distances(goal, points):
+    return np.sqrt(((points - goal) ** 2).sum(axis=1))
+
+def towncenter_distances(goal, points):
+    return np.sqrt((goal ** 2).sum()) + np.sqrt((points ** 2).sum(axis=1))
+
+def unidimensional_distances(goal, points):
+    return np.abs(points - goal).max(axis=1)
+
+def cosine_distances(goal, points):
+    return 1 - points @ goal / (np.sqrt((goal ** 2).sum()) * np.sqrt((points ** 2).sum(axis=1)))
+
+def chebyshev_distances(goal, points):
+    return np.abs(points - goal).max(axis=1)
+
+def unit_weight(a, b):
+    return 1
+
+# A* with weighted edges (weight_fn(a, b)) and a closed set, every node is expanded at most once
+# and heap entries of already closed nodes are skipped.
+# Nodes are coordinate tuples, heuristic_fn(goal, points) is one of the *_distances functions above,
+# called once per expanded node for all of its neighbours stacked into one array.
+# The arrays are kept in stacked (node -> array), pass the same dict to reuse them between queries on one graph.
+# Returns (path, cost, stats), path is empty if goal can't be reached.
+def astar_weighted(start, goal, neighbors_fn, heuristic_fn, weight_fn=unit_weight, stacked=None):
+    goal_point = np.array(goal, dtype=np.float64)
+    if stacked is None:
+        stacked = {}
+    front = [(0, 0, start)]
+    came_from = {start: None}
+    cost_so_far = {start: 0}
+    closed = set()
+    stats = {'expanded': 0, 'pushed': 1, 'stale': 0, 'heuristic_calls': 0, 'heuristic_points': 0}
+
+    while front:
+        _, cost, current = heapq.heappop(front)
+        if current in closed:
+            stats['stale'] += 1
+            continue
+        if current == goal:
+            break
+        closed.add(current)
+        stats['expanded'] += 1
+
+        neighbors = neighbors_fn(current)
+        if not neighbors:
+            continue
+        if current not in stacked:
+            stacked[current] = np.array(neighbors, dtype=np.float64).reshape(len(neighbors), -1)
+        estimates = heuristic_fn(goal_point, stacked[current]).tolist()
+        stats['heuristic_calls'] += 1
+        stats['heuristic_points'] += len(neighbors)
+        for neighbor, estimate in zip(neighbors, estimates):
+            if neighbor in closed:
+                continue
+            new_cost = cost + weight_fn(current, neighbor)
+            if new_cost < cost_so_far.get(neighbor, float('inf')):
+                cost_so_far[neighbor] = new_cost
+                came_from[neighbor] = current
+                heapq.heappush(front, (new_cost + estimate, new_cost, neighbor))
+                stats['pushed'] += 1
+
+    if goal not in came_from:
+        return [], float('inf'), stats
+    path = []
+    current = goal
+    while current is not None:
+        path.append(current)
+        current = came_from[current]
+    path.reverse()
+    return path, cost_so_far[goal], stats
+
+# Random graph of points in dimensions dimensions, every node linked to degree random others
+def random_graph(rng, node_count, degree, dimensions=7):
+    nodes = [tuple(rng.randint(0, 10) for _ in range(dimensions)) for _ in range(node_count)]
+    nodes = list(dict.fromkeys(nodes))
+    return {node: rng.sample(nodes, degree) for node in nodes}
+
 if __name__ == '__main__':
    
     graph = {
@@ -79,26 +165,41 @@ if __name__ == '__main__':
     start = (1, 2, 3, 4, 5, 6, 7)
     goal = (10, 10, 10, 10, 10, 10, 10)
     
-    path, cost = astar(start, goal, lambda node: graph[node], lambda a, b: manhattan_distance(a, b))
-    print(f"Path using Manhattan distance heuristic: {path}")
-    print(f"Cost using Manhattan distance heuristic: {cost}")
-
-    path, cost = astar(start, goal, lambda node: graph[node], lambda a, b: euclidean_distance(a, b))
-    print(f"Path using Euclid's distance heuristic: {path}")
-    print(f"Cost using Euclid's distance heuristic: {cost}")
-
-    path, cost = astar(start, goal, lambda node: graph[node], lambda a, b: towncenter_distance(a, b))
-    print(f"Path using Towncenter distance heuristic: {path}")
-    print(f"Cost using Towncenter distance heuristic: {cost}")
-
-    path, cost = astar(start, goal, lambda node: graph[node], lambda a, b: unidimensional_distance(a, b))
-    print(f"Path using unidimensional distance heuristic: {path}")
-    print(f"Cost using unidimensional distance heuristic: {cost}")
-
-    path, cost = astar(start, goal, lambda node: graph[node], lambda a, b: cosine_distance(a, b))
-    print(f"Path using cosine distance heuristic: {path}")
-    print(f"Cost using cosine distance heuristic: {cost}")    
+    heuristics = [
+        ('Manhattan', manhattan_distance, manhattan_distances),
+        ("Euclid's", euclidean_distance, euclidean_distances),
+        ('Towncenter', towncenter_distance, towncenter_distances),
+        ('unidimensional', unidimensional_distance, unidimensional_distances),
+        ('cosine', cosine_distance, cosine_distances),
+        ('Chebyshev', chebyshev_distance, chebyshev_distances),
+    ]
+    for name, _, heuristic in heuristics:
+        path, cost, stats = astar_weighted(start, goal, lambda node: graph[node], heuristic)
+        print(f"Path using {name} distance heuristic: {path}")
+        print(f"Cost using {name} distance heuristic: {cost}")
+        print(f"Stats using {name} distance heuristic: {stats}")
 
-    path, cost = astar(start, goal, lambda node: graph[node], lambda a, b: chebyshev_distance(a, b))
-    print(f"Path using Chebyshev distance heuristic: {path}")
-    print(f"Cost using Chebyshev distance heuristic: {cost}")    
\ No newline at end of file
+    # Speed on a bigger random graph, unit edge weights like in astar
+    # Usage: python astar.py [number of nodes] [degree] [number of queries] [seed]
+    node_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    degree = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    query_count = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    rng = random.Random(int(sys.argv[4]) if len(sys.argv) > 4 else 0)
+    graph = random_graph(rng, node_count, degree)
+    nodes = list(graph)
+    queries = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(query_count)]
+    print()
+    print(f"Random graph: {len(nodes)} nodes, {degree} neighbours each, {query_count} queries")
+    for name, scalar, heuristic in heuristics:
+        begin = timer()
+        for a, b in queries:
+            astar(a, b, lambda node: graph[node], scalar)
+        scalar_time = (timer() - begin) / query_count
+        expanded = 0
+        stacked = {}
+        begin = timer()
+        for a, b in queries:
+            expanded += astar_weighted(a, b, lambda node: graph[node], heuristic, stacked=stacked)[2]['expanded']
+        weighted_time = (timer() - begin) / query_count
+        print(f"{name}: astar {scalar_time * 1000:.3f} ms, astar_weighted {weighted_time * 1000:.3f} ms per query, "
+              f"{expanded / query_count:.1f} nodes expanded")
@@ -0,0 +1,5 @@
+# Offline routing benchmarks, run from lista1:
+#   python -m benchmark            - every algorithm of zadanie.py on a synthetic or given timetable
+#   python -m benchmark.memory     - memory of the timetable with several million connections
+#   python -m benchmark.heuristic  - nodes expanded by Dijkstra and A*
+#   python -m benchmark.build      - timetable build time per CSV row for growing CSVs (checks it is linear)
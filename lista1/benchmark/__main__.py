@@ -0,0 +1,148 @@
+# Runs every routing algorithm of zadanie.py on the same fixed-seed query set and reports
+# throughput, latency percentiles, nodes expanded, connections relaxed and peak memory per query.
+# Without --csv a synthetic timetable is generated, nothing is downloaded.
+# --json saves the report, --baseline compares against a saved one and exits with 1 on a regression.
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import tracemalloc
+from timeit import default_timer as timer
+
+import zadanie
+
+from .synthetic import syntheticColumns, writeCsv, randomQueries, writeQueries
+
+def profileHour(timetable, start, goal, current_time, stats=None):
+    return [(None, result) for _, _, result in zadanie.profileQuery(timetable, start, goal, current_time, current_time + 3600, stats)]
+
+# Starts from the coordinates of the start stop
+def fromCoordinates(timetable, start, goal, current_time, stats=None):
+    stop = timetable.stopIds[start]
+    return [(None, zadanie.csaFromCoordinates(timetable, timetable.stopLat[stop], timetable.stopLon[stop], goal, current_time, stats=stats))]
+
+algorithms = {**zadanie.modes, 'profile_1h': profileHour, 'csa_coordinates': fromCoordinates}
+
+def measure(timetable, search, queries, memorySample):
+    queries = [(query['start'], query['end'], zadanie.parseTime(query['time'])) for query in queries]
+    # Lazily built structures (stop index, footpaths) aren't part of a query
+    search(timetable, *queries[0])
+
+    stats = zadanie.Stats()
+    latencies = []
+    found = 0
+    inconsistent = 0
+    for start, goal, current_time in queries:
+        begin = timer()
+        journeys = search(timetable, start, goal, current_time, stats)
+        latencies.append(timer() - begin)
+        found += any(weight != float('inf') for _, (weight, _, _) in journeys)
+        inconsistent += sum(1 for _, (weight, path, entries) in journeys
+                            if weight != float('inf') and not zadanie.consistentPath(timetable, path, entries))
+
+    # tracemalloc slows searches down, so memory is measured in a separate pass
+    peak = 0
+    tracemalloc.start()
+    for start, goal, current_time in queries[:memorySample]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        search(timetable, start, goal, current_time)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return {
+        'queries': len(queries),
+        'found': found,
+        'inconsistent': inconsistent,
+        'throughput': len(queries) / sum(latencies),
+        'p50': zadanie.percentile(latencies, 50),
+        'p95': zadanie.percentile(latencies, 95),
+        'p99': zadanie.percentile(latencies, 99),
+        'expanded': stats.expanded / len(queries),
+        'edgesRelaxed': stats.edgesRelaxed / len(queries),
+        'peakMemory': peak,
+    }
+
+def presentReport(report):
+    print(f"{'algorithm':<16} {'queries/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'expanded':>10} {'relaxed':>10} {'peak KiB':>9} {'found':>6}")
+    for name, result in report['algorithms'].items():
+        print(f"{name:<16} {result['throughput']:>10.1f} {result['p50'] * 1000:>9.3f} {result['p95'] * 1000:>9.3f} {result['p99'] * 1000:>9.3f} "
+              f"{result['expanded']:>10.1f} {result['edgesRelaxed']:>10.1f} {result['peakMemory'] / 1024:>9.1f} {result['found']:>6}")
+    for name, result in report['algorithms'].items():
+        if result['inconsistent']:
+            print(f"{name}: {result['inconsistent']} journeys with entries out of order in time")
+
+# Median latency or throughput worse than the baseline by more than tolerance (a fraction) is a regression,
+# so is any journey whose entries don't follow each other in time (zadanie.consistentPath)
+def regressions(report, baseline, tolerance):
+    found = []
+    for name, result in report['algorithms'].items():
+        if result.get('inconsistent'):
+            found.append(f"{name}: {result['inconsistent']} journeys with inconsistent paths")
+        previous = baseline['algorithms'].get(name)
+        if previous is None:
+            continue
+        if result['p50'] > previous['p50'] * (1 + tolerance):
+            found.append(f"{name}: p50 {previous['p50'] * 1000:.3f} ms -> {result['p50'] * 1000:.3f} ms")
+        if result['throughput'] < previous['throughput'] / (1 + tolerance):
+            found.append(f"{name}: throughput {previous['throughput']:.1f}/s -> {result['throughput']:.1f}/s")
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmark')
+    parser.add_argument('--csv', help='timetable to benchmark instead of a synthetic one')
+    parser.add_argument('--stops', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=60)
+    parser.add_argument('--trips', type=int, default=80, help='trips per line')
+    parser.add_argument('--route-length', type=int, default=20, help='stops per line')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic timetable and of the queries')
+    parser.add_argument('--write-csv', help='keep the synthetic timetable in this file')
+    parser.add_argument('--queries', help='CSV/JSONL query file instead of random queries')
+    parser.add_argument('--count', type=int, default=300, help='number of random queries')
+    parser.add_argument('--write-queries', help='save the random queries to this CSV file')
+    parser.add_argument('--algorithms', nargs='+', choices=list(algorithms), default=list(algorithms))
+    parser.add_argument('--memory-sample', type=int, default=50, help='queries measured for peak memory')
+    parser.add_argument('--json', help='save the report to this file')
+    parser.add_argument('--baseline', help='report saved with --json to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.csv:
+            csvPath = pathlib.Path(args.csv)
+        else:
+            csvPath = pathlib.Path(args.write_csv or pathlib.Path(directory) / 'connection_graph.csv')
+            writeCsv(csvPath, syntheticColumns(args.stops, args.lines, args.trips, args.route_length, args.seed))
+        loadStats = zadanie.Stats()
+        # The cache is kept in the temporary directory, so the load is always measured from the CSV
+        timetable = zadanie.loadTimetable(csvPath, pathlib.Path(directory) / 'timetable.npz', loadStats)
+    print(f"Timetable {csvPath}: {len(timetable)} connections, {len(timetable.stopNames)} stops, {len(timetable.lineNames)} lines")
+    print(f"Load stats: {loadStats}")
+
+    if args.queries:
+        queries = zadanie.readQueries(args.queries)
+        known = [query for query in queries if query['start'] in timetable.stopIds and query['end'] in timetable.stopIds]
+        if len(known) < len(queries):
+            print(f"Skipping {len(queries) - len(known)} queries with unknown stops")
+        queries = known
+    else:
+        queries = randomQueries(timetable.stopNames, args.count, args.seed)
+    if args.write_queries:
+        writeQueries(args.write_queries, queries)
+
+    report = {'timetable': str(csvPath), 'connections': len(timetable), 'load': loadStats.timings, 'algorithms': dict()}
+    for name in args.algorithms:
+        report['algorithms'][name] = measure(timetable, algorithms[name], queries, args.memory_sample)
+    presentReport(report)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(report, json.load(file), args.tolerance)
+        for line in found:
+            print(f"Regression: {line}")
+        if found:
+            sys.exit(1)
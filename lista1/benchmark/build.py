@@ -0,0 +1,47 @@
+# Timetable build time (CSV parse + Timetable.fromColumns) on synthetic CSVs of increasing size.
+# Prints the time per row for every size and the growth exponent fitted on a log-log scale
+# (1 is linear), exits with 1 when it is above 1 + tolerance.
+# Usage (from lista1): python -m benchmark.build [largest number of rows] [sizes] [repeats] [tolerance] [seed]
+import pathlib
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+import zadanie
+
+from .synthetic import syntheticColumns, writeCsv
+
+largestRowCount = int(sys.argv[1]) if len(sys.argv) > 1 else 400_000
+sizeCount = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+tolerance = float(sys.argv[4]) if len(sys.argv) > 4 else 0.2
+seed = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+
+# Same stops and lines for every size, only the number of trips grows (halved from the largest size down)
+stopCount, lineCount, routeLength = 2000, 200, 20
+rowsPerTrip = lineCount * (routeLength - 1)
+tripCounts = sorted({max(1, -(-largestRowCount // rowsPerTrip) >> i) for i in range(sizeCount)})
+
+rowCounts = []
+times = []
+with tempfile.TemporaryDirectory() as directory:
+    for tripsPerLine in tripCounts:
+        csvPath = pathlib.Path(directory) / f"connections_{tripsPerLine}.csv"
+        writeCsv(csvPath, syntheticColumns(stopCount, lineCount, tripsPerLine, routeLength, seed))
+        # Best of repeats, the first parse also warms up the page cache
+        best = float('inf')
+        for _ in range(repeats):
+            begin = timer()
+            timetable = zadanie.Timetable.fromColumns(*zadanie.readCsvColumns(csvPath))
+            best = min(best, timer() - begin)
+        rowCounts.append(len(timetable))
+        times.append(best)
+        print(f"{len(timetable):>9} rows: {best:.3f}s, {best / len(timetable) * 1e6:.3f} µs per row")
+
+exponent = float(np.polyfit(np.log(rowCounts), np.log(times), 1)[0]) if len(rowCounts) > 1 else 1.0
+print(f"Build time grows as rows^{exponent:.2f}")
+if exponent > 1 + tolerance:
+    print(f"Regression: growth exponent above {1 + tolerance:.2f}")
+    sys.exit(1)
@@ -0,0 +1,40 @@
+# Nodes expanded by Dijkstra vs A* with the haversine heuristic (or ride time bounds, see zadanie.haversineHeuristic)
+# Usage (from lista1): python -m benchmark.heuristic [connection_graph.csv] [number of queries] [seed]
+import pathlib
+import random
+import sys
+from timeit import default_timer as timer
+
+import zadanie
+
+csvPath = pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else zadanie.csvPath
+queryCount = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+timetable = zadanie.loadTimetable(csvPath)
+if timetable.maxSpeed == float('inf'):
+    # Minute resolution timetables have zero-duration connections between different stops
+    print("Fastest connection: no speed bound (zero-duration connections), A* uses zadanie.rideTimeBounds")
+else:
+    print(f"Fastest connection: {timetable.maxSpeed:.2f} m/s")
+
+rng = random.Random(seed)
+stops = timetable.stopNames
+queries = [(rng.choice(stops), rng.choice(stops), rng.randint(5 * 3600, 21 * 3600)) for _ in range(queryCount)]
+
+results = dict()
+for name, search in (('Dijkstra', zadanie.dijkstra), ('A* haversine', zadanie.astarTime)):
+    expanded = 0
+    elapsed = 0
+    weights = list()
+    for start, goal, startTime in queries:
+        stats = zadanie.Stats()
+        begin = timer()
+        weights.append(search(timetable, start, goal, startTime, stats=stats)[0])
+        elapsed += timer() - begin
+        expanded += stats.expanded
+    results[name] = weights
+    print(f"{name}: {expanded / queryCount:.1f} nodes expanded per query, {elapsed / queryCount * 1000:.3f} ms per query")
+
+mismatches = sum(1 for a, b in zip(results['Dijkstra'], results['A* haversine']) if a != b)
+print(f"Queries with a different result: {mismatches}")
@@ -0,0 +1,53 @@
+# Memory used by the timetable on a synthetic network of several million connections
+# Usage (from lista1): python -m benchmark.memory [number of connections] [seed]
+import resource
+import sys
+import tracemalloc
+from datetime import time as clockTime
+from timeit import default_timer as timer
+
+import zadanie
+
+from .synthetic import syntheticColumns
+
+connectionCount = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000
+seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+# Rows in the layout of the original script (list of 9 objects per connection) are measured on a sample
+legacySample = 200_000
+
+def legacyRows(columns, count):
+    companyNames, lineNames, stopNames, company, line, departure, arrival, startStop, endStop, stopLat, stopLon = columns
+    def clock(seconds):
+        return clockTime(seconds // 3600 % 24, seconds % 3600 // 60, seconds % 60)
+    return [[companyNames[company[i]], lineNames[line[i]], clock(int(departure[i])), clock(int(arrival[i])),
+             stopNames[startStop[i]], stopNames[endStop[i]],
+             float(stopLat[startStop[i]]), float(stopLon[startStop[i]]), float(stopLat[endStop[i]])]
+            for i in range(count)]
+
+def megabytes(size):
+    return size / 2 ** 20
+
+lineCount, routeLength = 200, 20
+columns = syntheticColumns(lineCount=lineCount, tripsPerLine=-(-connectionCount // (lineCount * (routeLength - 1))),
+                           routeLength=routeLength, seed=seed)
+connectionCount = len(columns[5])
+print(f"Synthetic timetable: {connectionCount} connections, {len(columns[2])} stops, {len(columns[1])} lines")
+
+tracemalloc.start()
+begin = timer()
+timetable = zadanie.Timetable.fromColumns(*columns)
+elapsed = timer() - begin
+current, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(f"Timetable: {megabytes(current):.1f} MiB ({current / len(timetable):.1f} bytes per connection), "
+      f"peak while building {megabytes(peak):.1f} MiB, built in {elapsed:.2f}s")
+
+sample = min(legacySample, connectionCount)
+tracemalloc.start()
+rows = legacyRows(columns, sample)
+legacy = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+del rows
+print(f"List of rows: {legacy / sample:.1f} bytes per connection (measured on {sample} rows), "
+      f"~{megabytes(legacy / sample * connectionCount):.1f} MiB for the whole timetable, stored once")
+print(f"Max RSS: {megabytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024):.1f} MiB")
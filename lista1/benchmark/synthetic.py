@@ -0,0 +1,70 @@
+# Synthetic timetables and query sets, generated offline from a seed
+import csv
+import random
+
+import numpy as np
+
+import zadanie
+
+# Columns in the format of zadanie.readCsvColumns
+# Stops are spread over the Wrocław area, every line visits routeLength stops chosen by a random walk
+# over near neighbours and its tripsPerLine vehicles run the route at random times from 4:00 until midnight.
+def syntheticColumns(stopCount=2000, lineCount=200, tripsPerLine=100, routeLength=20, seed=0):
+    rng = np.random.default_rng(seed)
+    stopLat = rng.uniform(51.05, 51.15, stopCount)
+    stopLon = rng.uniform(16.95, 17.10, stopCount)
+    x = np.radians(stopLon) * np.cos(np.radians(51.1)) * zadanie.earthRadius
+    y = np.radians(stopLat) * zadanie.earthRadius
+    # Nearest stops found a block of rows at a time, a full stopCount x stopCount matrix could be too big
+    neighbours = np.concatenate([np.argsort(np.hypot(x[rows, None] - x, y[rows, None] - y), axis=1)[:, 1:9]
+                                 for rows in np.array_split(np.arange(stopCount), max(1, stopCount // 1000))])
+
+    company, line, departure, arrival, startStop, endStop = [], [], [], [], [], []
+    for lineId in range(lineCount):
+        route = [int(rng.integers(stopCount))]
+        while len(route) < routeLength:
+            candidates = [stop for stop in neighbours[route[-1]] if stop not in route]
+            route.append(int(rng.choice(candidates)) if candidates else int(rng.integers(stopCount)))
+        route = np.array(route)
+        # 8 m/s between stops plus 20 s at every stop
+        hops = np.hypot(x[route[1:]] - x[route[:-1]], y[route[1:]] - y[route[:-1]]) / 8 + 20
+        offsets = np.concatenate(([0], np.cumsum(hops.astype(np.int32))))
+        starts = np.sort(rng.integers(4 * 3600, 24 * 3600, tripsPerLine))
+        departure.append((starts[:, None] + offsets[:-1]).ravel())
+        arrival.append((starts[:, None] + offsets[1:]).ravel())
+        startStop.append(np.tile(route[:-1], tripsPerLine))
+        endStop.append(np.tile(route[1:], tripsPerLine))
+        line.append(np.full(tripsPerLine * (routeLength - 1), lineId))
+        company.append(np.full(tripsPerLine * (routeLength - 1), lineId % 3))
+    columns = [np.concatenate(column).astype(np.int32) for column in (company, line, departure, arrival, startStop, endStop)]
+    return (['MPK Autobusy', 'MPK Tramwaje', 'Polregio'], [str(lineId) for lineId in range(lineCount)],
+            [f"Stop {stopId}" for stopId in range(stopCount)], *columns, stopLat, stopLon)
+
+# Writes columns as a connection_graph.csv file
+def writeCsv(path, columns):
+    companyNames, lineNames, stopNames, company, line, departure, arrival, startStop, endStop, stopLat, stopLon = columns
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['', 'Unnamed: 0', 'company', 'line', 'departure_time', 'arrival_time', 'start_stop', 'end_stop',
+                         'start_stop_lat', 'start_stop_lon', 'end_stop_lat', 'end_stop_lon'])
+        for i in range(len(departure)):
+            start, end = startStop[i], endStop[i]
+            writer.writerow([i, i, companyNames[company[i]], lineNames[line[i]],
+                             zadanie.formatTime(int(departure[i])), zadanie.formatTime(int(arrival[i])),
+                             stopNames[start], stopNames[end], stopLat[start], stopLon[start], stopLat[end], stopLon[end]])
+
+# Random queries between different stops, departing between 5:00 and 21:00
+def randomQueries(stopNames, count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        start, end = rng.sample(stopNames, 2)
+        queries.append({'start': start, 'end': end, 'time': zadanie.formatTime(rng.randint(5 * 3600, 21 * 3600))})
+    return queries
+
+# Same format as the zadanie.py --batch input (without a mode, every algorithm answers every query)
+def writeQueries(path, queries):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['start', 'end', 'time'])
+        writer.writeheader()
+        writer.writerows(queries)
@@ -0,0 +1,237 @@
+# Contraction hierarchies for repeated shortest path queries on a static, undirected Graph (djikstra.py)
+# Nodes are contracted one by one in order of importance, a shortcut u-w replaces every path u-v-w
+# through the contracted node v that has no witness path (a path avoiding v that is not longer).
+# A query is a bidirectional Dijkstra that only follows edges to more important nodes.
+import heapq
+import pathlib
+import pickle
+import random
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import djikstra
+
+class ContractionHierarchy:
+    # nodes - node names by id, rank - contraction order of every node,
+    # up_edges[v] - (neighbor, weight) of edges from v to higher ranked nodes,
+    # middles - contracted node of every shortcut, keyed by (smaller id, larger id)
+    def __init__(self, nodes, rank, up_edges, middles):
+        self.nodes = nodes
+        self.node_ids = {node: node_id for node_id, node in enumerate(nodes)}
+        self.rank = rank
+        self.up_edges = up_edges
+        self.middles = middles
+
+    # witness_limit bounds the number of nodes settled by one witness search,
+    # a search cut short can only add unnecessary shortcuts, never lose a path
+    @classmethod
+    def build(cls, graph_dict, witness_limit=100):
+        nodes = list(graph_dict)
+        node_ids = {node: node_id for node_id, node in enumerate(nodes)}
+        # Remaining graph, parallel edges merged and loops dropped
+        adjacency = [dict() for _ in nodes]
+        for node, edges in graph_dict.items():
+            u = node_ids[node]
+            for neighbor, weight in edges:
+                w = node_ids[neighbor]
+                if u != w and weight < adjacency[u].get(w, float('inf')):
+                    adjacency[u][w] = weight
+        middles = {}
+        contracted_neighbors = [0] * len(nodes)
+        rank = [0] * len(nodes)
+        up_edges = [None] * len(nodes)
+
+        def shortcuts(v):
+            result = []
+            neighbors = list(adjacency[v].items())
+            for i, (u, weight_u) in enumerate(neighbors):
+                targets = {w: weight_u + weight_w for w, weight_w in neighbors[i + 1:]}
+                if not targets:
+                    continue
+                witnesses = witness_search(u, v, targets)
+                for w, through in targets.items():
+                    if witnesses.get(w, float('inf')) > through:
+                        result.append((u, w, through))
+            return result
+
+        # Dijkstra from u without v, until every target is settled or farther than its path through v,
+        # at most witness_limit settled nodes
+        def witness_search(u, v, targets):
+            max_distance = max(targets.values())
+            remaining = len(targets)
+            distances = {u: 0}
+            pq = [(0, u)]
+            settled = 0
+            while pq and settled < witness_limit:
+                curr_dist, curr_node = heapq.heappop(pq)
+                if curr_dist > distances[curr_node]:
+                    continue
+                if curr_dist > max_distance:
+                    break
+                settled += 1
+                if curr_node in targets:
+                    remaining -= 1
+                    if remaining == 0:
+                        break
+                for neighbor, weight in adjacency[curr_node].items():
+                    new_dist = curr_dist + weight
+                    if neighbor != v and new_dist < distances.get(neighbor, float('inf')):
+                        distances[neighbor] = new_dist
+                        heapq.heappush(pq, (new_dist, neighbor))
+            return distances
+
+        # Edge difference plus contracted neighbors, contracting evenly across the graph
+        def priority(v):
+            return len(shortcuts(v)) - len(adjacency[v]) + contracted_neighbors[v]
+
+        pq = [(priority(v), v) for v in range(len(nodes))]
+        heapq.heapify(pq)
+        order = 0
+        while pq:
+            _, v = heapq.heappop(pq)
+            # Lazy update, priorities change as neighbors get contracted
+            current = priority(v)
+            if pq and current > pq[0][0]:
+                heapq.heappush(pq, (current, v))
+                continue
+            for u, w, weight in shortcuts(v):
+                if weight < adjacency[u].get(w, float('inf')):
+                    adjacency[u][w] = weight
+                    adjacency[w][u] = weight
+                    middles[(min(u, w), max(u, w))] = v
+            rank[v] = order
+            order += 1
+            up_edges[v] = list(adjacency[v].items())
+            for u in adjacency[v]:
+                del adjacency[u][v]
+                contracted_neighbors[u] += 1
+            adjacency[v] = {}
+        return cls(nodes, rank, up_edges, middles)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump((self.nodes, self.rank, self.up_edges, self.middles), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls(*pickle.load(file))
+
+    # Same contract as djikstra.shortest_path: (distance, path of node names), path is [goal] if unreachable
+    def shortest_path(self, start, goal):
+        distance, path = self.query(self.node_ids[start], self.node_ids[goal])
+        return distance, [self.nodes[node] for node in path]
+
+    def query(self, start, goal):
+        distances = ({start: 0}, {goal: 0})
+        prev_nodes = ({start: None}, {goal: None})
+        pqs = ([(0, start)], [(0, goal)])
+        best, meeting = (0, start) if start == goal else (float('inf'), None)
+        while pqs[0] or pqs[1]:
+            # A side is done once its top can't beat the best meeting point
+            side = 0 if pqs[0] and (not pqs[1] or pqs[0][0][0] <= pqs[1][0][0]) else 1
+            curr_dist, curr_node = heapq.heappop(pqs[side])
+            if curr_dist >= best:
+                pqs[side].clear()
+                continue
+            if curr_dist > distances[side][curr_node]:
+                continue
+            if curr_node in distances[1 - side] and curr_dist + distances[1 - side][curr_node] < best:
+                best = curr_dist + distances[1 - side][curr_node]
+                meeting = curr_node
+            for neighbor, weight in self.up_edges[curr_node]:
+                new_dist = curr_dist + weight
+                if new_dist < distances[side].get(neighbor, float('inf')):
+                    distances[side][neighbor] = new_dist
+                    prev_nodes[side][neighbor] = curr_node
+                    heapq.heappush(pqs[side], (new_dist, neighbor))
+        if meeting is None:
+            return float('inf'), [goal]
+
+        # Hierarchy path start -> meeting <- goal, every edge unpacked into original edges
+        up_path = []
+        curr_node = meeting
+        while curr_node is not None:
+            up_path.append(curr_node)
+            curr_node = prev_nodes[0][curr_node]
+        up_path.reverse()
+        curr_node = prev_nodes[1][meeting]
+        while curr_node is not None:
+            up_path.append(curr_node)
+            curr_node = prev_nodes[1][curr_node]
+        path = [start]
+        for u, w in zip(up_path, up_path[1:]):
+            path.extend(self.unpack(u, w))
+        return best, path
+
+    # Nodes after u on the original edges making up edge u-w
+    def unpack(self, u, w):
+        result = []
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            middle = self.middles.get((min(a, b), max(a, b)))
+            if middle is None:
+                result.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return result
+
+def random_edges(rng, node_count, edge_count, max_weight=20):
+    return [(rng.randrange(node_count), rng.randrange(node_count), rng.randint(1, max_weight)) for _ in range(edge_count)]
+
+# Road-like test graph: a grid with random weights and a few random long edges
+def grid_edges(rng, side, max_weight=20):
+    edges = []
+    for i in range(side):
+        for j in range(side):
+            node = i * side + j
+            if j + 1 < side:
+                edges.append((node, node + 1, rng.randint(1, max_weight)))
+            if i + 1 < side:
+                edges.append((node, node + side, rng.randint(1, max_weight)))
+    edges.extend((rng.randrange(side * side), rng.randrange(side * side), rng.randint(5, 5 * max_weight)) for _ in range(side))
+    return edges
+
+# Compares hierarchy queries with djikstra.dijkstra on random graphs and times both on a grid
+# Usage: python contraction.py [number of random graphs] [grid side] [seed]
+if __name__ == '__main__':
+    graph_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    side = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rng = random.Random(int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+
+    mismatches = 0
+    for _ in range(graph_count):
+        node_count = rng.randint(2, 80)
+        edges = random_edges(rng, node_count, rng.randint(1, 4 * node_count))
+        graph = djikstra.Graph(edges)
+        hierarchy = ContractionHierarchy.build(graph.graph_dict)
+        nodes = list(graph.graph_dict)
+        weights = {}
+        for u, w, weight in edges:
+            weights[(u, w)] = weights[(w, u)] = min(weight, weights.get((u, w), float('inf')))
+        for start in rng.sample(nodes, min(5, len(nodes))):
+            distances, _ = djikstra.dijkstra(graph.graph_dict, start)
+            for goal in nodes:
+                distance, path = hierarchy.shortest_path(start, goal)
+                valid = path[0] == start and path[-1] == goal and sum(weights[edge] for edge in zip(path, path[1:])) == distance
+                if distance != distances[goal] or (distance != float('inf') and not valid):
+                    mismatches += 1
+    print(f"Random graphs: {graph_count}, mismatches with dijkstra: {mismatches}")
+
+    graph = djikstra.Graph(grid_edges(rng, side))
+    begin = timer()
+    hierarchy = ContractionHierarchy.build(graph.graph_dict)
+    print(f"Grid {side}x{side}: preprocessing {timer() - begin:.2f}s, {len(hierarchy.middles)} shortcuts")
+    with tempfile.TemporaryDirectory() as directory:
+        hierarchy.save(pathlib.Path(directory) / 'grid.ch')
+        hierarchy = ContractionHierarchy.load(pathlib.Path(directory) / 'grid.ch')
+    queries = [(rng.randrange(side * side), rng.randrange(side * side)) for _ in range(100)]
+    begin = timer()
+    expected = [djikstra.shortest_path(graph.graph_dict, start, goal)[0] for start, goal in queries]
+    print(f"dijkstra: {(timer() - begin) / len(queries) * 1000:.3f} ms per query")
+    begin = timer()
+    found = [hierarchy.shortest_path(start, goal)[0] for start, goal in queries]
+    print(f"contraction hierarchy: {(timer() - begin) / len(queries) * 1000:.3f} ms per query, mismatches: {sum(a != b for a, b in zip(expected, found))}")
@@ -1,6 +1,11 @@
 # Autor: Dr inż. Piotr Syga
 # Źródło: https://syga.kft.pwr.edu.pl/courses/siiiw/dijkstra.py
 import heapq
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
 class Graph:
     def __init__(self, edges):
         self.edges = edges
@@ -33,8 +38,140 @@ def dijkstra(graph_dict, start):
                 heapq.heappush(pq, (new_dist, neighbor))
     return distances, prev_nodes
 
-def shortest_path(graph_dict, start, goal):
-    distances, prev_nodes = dijkstra(graph_dict, start)
+# Compressed sparse row graph, built from the same (start, end, weight) edges as Graph (also undirected)
+# Nodes are mapped to dense ids (node_ids, nodes), edges leaving node i are at offsets[i]:offsets[i+1]
+# of targets and weights. distances and prev are reused by every query, only the entries
+# touched by the previous query are reset.
+class CSRGraph:
+    def __init__(self, edges):
+        self.node_ids = {}
+        sources = array('i')
+        ends = array('i')
+        weights = array('d')
+        for start, end, weight in edges:
+            sources.append(self.node_ids.setdefault(start, len(self.node_ids)))
+            ends.append(self.node_ids.setdefault(end, len(self.node_ids)))
+            weights.append(weight)
+        self.nodes = list(self.node_ids)
+        sources = np.frombuffer(sources, dtype=np.int32)
+        ends = np.frombuffer(ends, dtype=np.int32)
+        weights = np.frombuffer(weights, dtype=np.float64)
+        # Both directions of every edge, grouped by source
+        all_sources = np.concatenate((sources, ends))
+        order = np.argsort(all_sources, kind='stable')
+        self.targets = np.concatenate((ends, sources))[order]
+        self.weights = np.concatenate((weights, weights))[order]
+        self.offsets = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_sources, minlength=len(self.nodes)), out=self.offsets[1:])
+        self.distances = array('d', [float('inf')]) * len(self.nodes)
+        self.prev = array('i', [-1]) * len(self.nodes)
+        self.touched = []
+
+    @classmethod
+    def from_graph(cls, graph):
+        return cls(graph.edges)
+
+    def neighbors(self, node):
+        begin, end = self.offsets[node], self.offsets[node + 1]
+        return zip(self.targets[begin:end].tolist(), self.weights[begin:end].tolist())
+
+    def reset(self):
+        for node in self.touched:
+            self.distances[node] = float('inf')
+            self.prev[node] = -1
+        self.touched = []
+
+# Dijkstra on a CSRGraph from node id start, stops after settling goal if it is given.
+# Returns the graph's distances and prev arrays, they are overwritten by the next query.
+def csr_dijkstra(graph, start, goal=None):
+    graph.reset()
+    distances = graph.distances
+    prev = graph.prev
+    touched = graph.touched
+    distances[start] = 0
+    touched.append(start)
+    pq = [(0, start)]
+    while pq:
+        curr_dist, curr_node = heapq.heappop(pq)
+        if curr_node == goal:
+            break
+        if curr_dist > distances[curr_node]:
+            continue
+        for neighbor, weight in graph.neighbors(curr_node):
+            new_dist = curr_dist + weight
+            if new_dist < distances[neighbor]:
+                if distances[neighbor] == float('inf'):
+                    touched.append(neighbor)
+                distances[neighbor] = new_dist
+                prev[neighbor] = curr_node
+                heapq.heappush(pq, (new_dist, neighbor))
+    return distances, prev
+
+# Dijkstra from both ends at once (the graph is undirected, so the backward search uses the same edges).
+# Each step settles a node on the side with the smaller queue and stops when the tops together
+# can't beat the best path found through a node reached from both sides.
+# Returns (distance, path, number of settled nodes), path is [goal] when goal can't be reached.
+def bidirectional_dijkstra(neighbors_fn, start, goal):
+    if start == goal:
+        return 0, [start], 0
+    distances = ({start: 0}, {goal: 0})
+    prev_nodes = ({start: None}, {goal: None})
+    settled = (set(), set())
+    pqs = ([(0, start)], [(0, goal)])
+    best, meeting = float('inf'), None
+    while True:
+        # Drop stale entries, so the tops are the real frontier distances
+        for side in (0, 1):
+            while pqs[side] and pqs[side][0][1] in settled[side]:
+                heapq.heappop(pqs[side])
+        if not pqs[0] or not pqs[1] or pqs[0][0][0] + pqs[1][0][0] >= best:
+            break
+        side = 0 if len(pqs[0]) <= len(pqs[1]) else 1
+        curr_dist, curr_node = heapq.heappop(pqs[side])
+        settled[side].add(curr_node)
+        for neighbor, weight in neighbors_fn(curr_node):
+            new_dist = curr_dist + weight
+            if new_dist < distances[side].get(neighbor, float('inf')):
+                distances[side][neighbor] = new_dist
+                prev_nodes[side][neighbor] = curr_node
+                heapq.heappush(pqs[side], (new_dist, neighbor))
+            if neighbor in distances[1 - side] and new_dist + distances[1 - side][neighbor] < best:
+                best = new_dist + distances[1 - side][neighbor]
+                meeting = neighbor
+    settled_count = len(settled[0]) + len(settled[1])
+    if meeting is None:
+        return float('inf'), [goal], settled_count
+    path = []
+    curr_node = meeting
+    while curr_node is not None:
+        path.append(curr_node)
+        curr_node = prev_nodes[0][curr_node]
+    path.reverse()
+    curr_node = prev_nodes[1][meeting]
+    while curr_node is not None:
+        path.append(curr_node)
+        curr_node = prev_nodes[1][curr_node]
+    return best, path, settled_count
+
+# graph is a Graph.graph_dict or a CSRGraph, returns (distance, path of node names) either way
+# bidirectional=True searches from both ends, which settles far fewer nodes on large graphs
+def shortest_path(graph, start, goal, bidirectional=False):
+    if isinstance(graph, CSRGraph):
+        if bidirectional:
+            distance, path, _ = bidirectional_dijkstra(graph.neighbors, graph.node_ids[start], graph.node_ids[goal])
+            return distance, [graph.nodes[node] for node in path]
+        distances, prev = csr_dijkstra(graph, graph.node_ids[start], graph.node_ids[goal])
+        path = []
+        curr_node = graph.node_ids[goal]
+        while curr_node != -1:
+            path.append(graph.nodes[curr_node])
+            curr_node = prev[curr_node]
+        path.reverse()
+        return distances[graph.node_ids[goal]], path
+    if bidirectional:
+        distance, path, _ = bidirectional_dijkstra(graph.__getitem__, start, goal)
+        return distance, path
+    distances, prev_nodes = dijkstra(graph, start)
     path = []
     curr_node = goal
     while curr_node is not None:
@@ -47,12 +184,70 @@ def manhattan_dist(graph_dict, node, goal):
     distance, path = shortest_path(graph_dict, node, goal)
     return distance, path
 
-edges = [
-        ('A', 'B', 2), ('A', 'C', 4), ('B', 'D', 3), ('C', 'D', 1),
-        ('C', 'E', 7), ('D', 'F', 5), ('E', 'F', 4), ('E', 'G', 2),
-        ('F', 'H', 1), ('G', 'H', 2)
-]
-gg = Graph(edges)
-distance, path = manhattan_dist(gg.graph_dict, 'A', 'H')
-print("Shortest distance:", distance)
-print("Shortest path:", path) 
\ No newline at end of file
+# Many-to-many distances
+# Every source is one full Dijkstra on a CSRGraph. Sources are split across a pool of processes,
+# with fork the workers inherit the graph from the parent instead of getting it pickled.
+worker_graph = None
+worker_targets = None
+
+def init_worker(graph, target_ids):
+    global worker_graph, worker_targets
+    worker_graph = graph
+    worker_targets = target_ids
+
+def worker_row(source_id):
+    distances, _ = csr_dijkstra(worker_graph, source_id)
+    return np.frombuffer(distances, dtype=np.float64)[worker_targets]
+
+# Yields (source, row of distances to targets) in order of sources, only a few rows are held in memory at once.
+# graph is a Graph or a CSRGraph, workers=1 computes the rows in this process.
+def distance_rows(graph, sources, targets, workers=None, chunksize=16):
+    if not isinstance(graph, CSRGraph):
+        graph = CSRGraph.from_graph(graph)
+    source_ids = [graph.node_ids[source] for source in sources]
+    target_ids = np.array([graph.node_ids[target] for target in targets], dtype=np.int64)
+    if workers == 1:
+        init_worker(graph, target_ids)
+        for source, source_id in zip(sources, source_ids):
+            yield source, worker_row(source_id)
+        return
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(graph, target_ids)) as pool:
+        yield from zip(sources, pool.map(worker_row, source_ids, chunksize=chunksize))
+
+# Dense len(sources) x len(targets) matrix of distances (inf where a target can't be reached).
+# With out (a .npy path) the rows are written to a memory mapped file as they arrive, so the matrix
+# doesn't have to fit in memory, the opened memmap is returned.
+def distance_matrix(graph, sources, targets, workers=None, out=None):
+    shape = (len(sources), len(targets))
+    if out is None:
+        matrix = np.empty(shape, dtype=np.float64)
+    else:
+        matrix = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64, shape=shape)
+    for i, (_, row) in enumerate(distance_rows(graph, sources, targets, workers)):
+        matrix[i] = row
+    if out is not None:
+        matrix.flush()
+    return matrix
+
+if __name__ == '__main__':
+    edges = [
+            ('A', 'B', 2), ('A', 'C', 4), ('B', 'D', 3), ('C', 'D', 1),
+            ('C', 'E', 7), ('D', 'F', 5), ('E', 'F', 4), ('E', 'G', 2),
+            ('F', 'H', 1), ('G', 'H', 2)
+    ]
+    gg = Graph(edges)
+    distance, path = manhattan_dist(gg.graph_dict, 'A', 'H')
+    print("Shortest distance:", distance)
+    print("Shortest path:", path)
+
+    distance, path = shortest_path(CSRGraph.from_graph(gg), 'A', 'H')
+    print("Shortest distance (CSR):", distance)
+    print("Shortest path (CSR):", path)
+
+    distance, path = shortest_path(gg.graph_dict, 'A', 'H', bidirectional=True)
+    print("Shortest distance (bidirectional):", distance)
+    print("Shortest path (bidirectional):", path)
+
+    print("Distance matrix:")
+    print(distance_matrix(gg, ['A', 'B', 'C'], ['F', 'G', 'H']))
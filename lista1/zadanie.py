@@ -5,60 +5,372 @@
 #   https://syga.kft.pwr.edu.pl/courses/siiiw/astar.py
 
 import pathlib
+import argparse
 import csv
+import json
 import math
+import multiprocessing
+import os
 import sys
-from datetime import *
+import tempfile
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import numpy as np
 from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 parentDirPath = pathlib.Path(__file__).parent.resolve()
 
 csvPath = parentDirPath / "connection_graph.csv"
-data = list()
+# Parsed timetable is cached next to the CSV as columns in a .npz file
+cachePath = csvPath.with_suffix('.npz')
+cacheVersion = 4
+
+# Earth radius in meters
+earthRadius = 6371000
+# Walking speed (m/s) and the longest walk (meters) between two stops considered a transfer
+walkingSpeed = 1.2
+maxWalk = 400
+# Goals whose ride time bounds (rideTimeBounds) are kept per timetable
+boundCacheSize = 64
+
+# Times are kept as integer seconds since midnight
+def parseTime(text):
+    hours, minutes, seconds = (text.split(':') + ['0'])[:3]
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def formatTime(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+# Counters of a search and timings of its phases (also used for loading)
+#   pushes, pops, stalePops - priority queue operations, stale pops are skipped entries with an outdated distance
+#   edgesRelaxed - connections considered for relaxation
+#   edgesRejected - connections rejected by the time feasibility check (departed or arriving before we are at the stop),
+#                   including the ones skipped by the binary search
+#   tripsSkipped - later trips of a pattern whose first reachable trip was already considered
+class Stats:
+    counterNames = ('pushes', 'pops', 'stalePops', 'edgesRelaxed', 'edgesRejected', 'tripsSkipped')
+
+    def __init__(self):
+        for name in self.counterNames:
+            setattr(self, name, 0)
+        self.timings = dict()
+
+    @property
+    def expanded(self):
+        return self.pops - self.stalePops
+
+    @contextmanager
+    def phase(self, name):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + timer() - start
+
+    def toDict(self):
+        result = {name: getattr(self, name) for name in self.counterNames}
+        result['timings'] = dict(self.timings)
+        return result
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+    def __str__(self):
+        parts = list()
+        if any(getattr(self, name) for name in self.counterNames):
+            parts.append(', '.join(f"{name}: {getattr(self, name)}" for name in self.counterNames))
+        if self.timings:
+            parts.append(', '.join(f"{name}: {seconds:.6f}s" for name, seconds in self.timings.items()))
+        return '; '.join(parts)
+
+# Timetable:
+#   Connections are stored in parallel int32 columns, sorted by start stop and then by departure.
+#   Company, line and stop names are interned to integer ids.
+#   Connections leaving stop s are at indices offsets[s] to offsets[s+1].
+#   Coordinates are stored once per stop (also in radians, as NumPy arrays).
+#   maxSpeed is the highest speed (m/s) of any connection, used by the A* heuristic (inf when some connection
+#   covers a distance in zero time, the heuristic then uses rideTimeBounds instead).
+#   stopGraph() returns the stop pairs linked by a connection with their shortest duration, by end stop, built on first use.
+#   Connections sharing start stop, line and end stop form a pattern, patternCounts[s] is the number of patterns at stop s.
+#   scanOrder lists all connections sorted by departure and then by arrival (used by CSA).
+#   stopIndex() returns the spatial index over stops, built on first use.
+class Timetable:
+    def __init__(self, companyNames, lineNames, stopNames, company, line, departure, arrival, startStop, endStop, stopLat, stopLon, pattern=None, scanOrder=None):
+        self.companyNames = companyNames
+        self.lineNames = lineNames
+        self.stopNames = stopNames
+        self.stopIds = {name: stopId for stopId, name in enumerate(stopNames)}
+        self.company = company
+        self.line = line
+        self.departure = departure
+        self.arrival = arrival
+        self.startStop = startStop
+        self.endStop = endStop
+        self.stopLat = stopLat
+        self.stopLon = stopLon
+        startStops = np.frombuffer(startStop, dtype=np.int32)
+        self.offsets = toArray(np.concatenate(([0], np.cumsum(np.bincount(startStops, minlength=len(stopNames))))), 'i')
+        if pattern is None:
+            key = (startStops.astype(np.int64) * len(lineNames) + np.frombuffer(line, dtype=np.int32)) * len(stopNames) + np.frombuffer(endStop, dtype=np.int32)
+            _, pattern = np.unique(key, return_inverse=True)
+            pattern = toArray(pattern, 'i')
+        self.pattern = pattern
+        # Every pattern belongs to one start stop
+        patterns = np.frombuffer(pattern, dtype=np.int32)
+        patternStarts = np.zeros(int(patterns.max()) + 1 if len(patterns) else 0, dtype=np.int32)
+        patternStarts[patterns] = startStops
+        self.patternCounts = toArray(np.bincount(patternStarts, minlength=len(stopNames)), 'i')
+        self.stopLatRad = np.radians(np.frombuffer(stopLat, dtype=np.float64))
+        self.stopLonRad = np.radians(np.frombuffer(stopLon, dtype=np.float64))
+        self.maxSpeed = self.fastestConnectionSpeed()
+        if scanOrder is None:
+            scanOrder = toArray(np.lexsort((np.frombuffer(arrival, dtype=np.int32), np.frombuffer(departure, dtype=np.int32))), 'i')
+        self.scanOrder = scanOrder
+        self.index = None
+        self.reverseStopGraph = None
+        self.boundCache = OrderedDict()
+
+    def stopIndex(self):
+        if self.index is None:
+            self.index = StopIndex(self)
+        return self.index
+
+    # (offsets, startStops, durations): pairs arriving at stop s are at offsets[s] to offsets[s+1]
+    def stopGraph(self):
+        if self.reverseStopGraph is None:
+            startStop = np.frombuffer(self.startStop, dtype=np.int32).astype(np.int64)
+            endStop = np.frombuffer(self.endStop, dtype=np.int32).astype(np.int64)
+            duration = np.maximum(np.frombuffer(self.arrival, dtype=np.int32) - np.frombuffer(self.departure, dtype=np.int32), 0)
+            stopCount = len(self.stopNames)
+            order = np.lexsort((duration, startStop, endStop))
+            key = endStop[order] * stopCount + startStop[order]
+            first = np.concatenate(([True], key[1:] != key[:-1])) if len(key) else np.zeros(0, dtype=bool)
+            pairs = order[first]
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(endStop[pairs], minlength=stopCount))))
+            self.reverseStopGraph = (offsets.tolist(), startStop[pairs].tolist(), duration[pairs].tolist())
+        return self.reverseStopGraph
+
+    # A zero-duration connection between different places (common with minute resolution) has no speed bound,
+    # any assumed minimum duration could make the heuristic overestimate, so the speed is inf
+    def fastestConnectionSpeed(self):
+        startStop = np.frombuffer(self.startStop, dtype=np.int32)
+        endStop = np.frombuffer(self.endStop, dtype=np.int32)
+        duration = np.frombuffer(self.arrival, dtype=np.int32) - np.frombuffer(self.departure, dtype=np.int32)
+        dLat = self.stopLatRad[endStop] - self.stopLatRad[startStop]
+        dLon = self.stopLonRad[endStop] - self.stopLonRad[startStop]
+        a = np.sin(dLat / 2) ** 2 + np.cos(self.stopLatRad[startStop]) * np.cos(self.stopLatRad[endStop]) * np.sin(dLon / 2) ** 2
+        distance = 2 * earthRadius * np.arcsin(np.sqrt(a))
+        if ((duration <= 0) & (distance > 0)).any():
+            return math.inf
+        moving = duration > 0
+        return float(np.max(distance[moving] / duration[moving])) if moving.any() else 1.0
+
+    def __len__(self):
+        return len(self.departure)
+
+    # Columns can be lists, arrays or NumPy arrays, they are converted to int32/float64 arrays sorted by (startStop, departure)
+    @classmethod
+    def fromColumns(cls, companyNames, lineNames, stopNames, company, line, departure, arrival, startStop, endStop, stopLat, stopLon):
+        order = np.lexsort((np.asarray(departure), np.asarray(startStop)))
+        def column(values):
+            return toArray(np.asarray(values)[order], 'i')
+        return cls(companyNames, lineNames, stopNames,
+                   column(company), column(line), column(departure), column(arrival),
+                   column(startStop), column(endStop),
+                   toArray(np.asarray(stopLat), 'd'), toArray(np.asarray(stopLon), 'd'))
+
+# Copies a NumPy array (or a list) into a typed array: 'i' int32, 'd' float64
+def toArray(values, typecode):
+    result = array(typecode)
+    result.frombytes(np.asarray(values, dtype=np.int32 if typecode == 'i' else np.float64).tobytes())
+    return result
 
 # ,Unnamed: 0,company,line,departure_time,arrival_time,start_stop,end_stop,start_stop_lat,start_stop_lon,end_stop_lat,end_stop_lon
-# Load data into list of lists
-print('Converting data into initial list...')
-with open(csvPath) as file:
-    reader = csv.reader(file, delimiter=',')
-    next(reader)
-    for row in reader:
-        row[4] = datetime.strptime(row[4], '%H:%M:%S').time()
-        row[5] = datetime.strptime(row[5], '%H:%M:%S').time()
-        row[8] = float(row[8]) 
-        row[9] = float(row[9])
-        row[10] = float(row[10])
-        row[11] = float(row[11])
-        data.append(row[2::])
-# company, line, departure_time, arrival_time, start_stop, end_stop, start_stop_lat, start_stop_lon, end_stop_lat, end_stop_lon
-
-# Convert data to dictionary
-print('Converting initial parse into graph dictionary (might take a bit)...')
-stops = set()
-for row in data:
-    stops.add(row[4])
-
-mainGraph = dict()
-for key in stops:
-    value = list()
-    filteredForKey = filter(lambda dataRow: dataRow[4] == key , data)
-    for row in filteredForKey:
-        row = row.copy()
-        row.pop(4)
-        value.append(row)
-    mainGraph[key] = value
-
-# mainGraph:
-#   Key: start_stop;
-#   Value: list of: company, line, departure_time, arrival_time, end_stop, start_stop_lat, start_stop_lon, end_stop_lat, end_stop_lon
-
-def getTimeSeconds(time):
-    return timedelta(hours=time.hour, minutes=time.minute, seconds=time.second).total_seconds()
-
-def addSecondsToTime(time, seconds):
-    temp_date = datetime(1,1,1, time.hour, time.minute, time.second)
-    temp_date += timedelta(seconds=seconds)
-    return temp_date.time()
+# Returns arguments of Timetable.fromColumns
+def readCsvColumns(csvPath):
+    companyIds = dict()
+    lineIds = dict()
+    stopIds = dict()
+    stopLat = list()
+    stopLon = list()
+    def stopId(name, lat, lon):
+        if name not in stopIds:
+            stopIds[name] = len(stopIds)
+            stopLat.append(float(lat))
+            stopLon.append(float(lon))
+        return stopIds[name]
+
+    company, line, departure, arrival, startStop, endStop = (array('i') for _ in range(6))
+    with open(csvPath) as file:
+        reader = csv.reader(file, delimiter=',')
+        next(reader)
+        for row in reader:
+            company.append(companyIds.setdefault(row[2], len(companyIds)))
+            line.append(lineIds.setdefault(row[3], len(lineIds)))
+            departure.append(parseTime(row[4]))
+            arrival.append(parseTime(row[5]))
+            startStop.append(stopId(row[6], row[8], row[9]))
+            endStop.append(stopId(row[7], row[10], row[11]))
+    return (list(companyIds), list(lineIds), list(stopIds),
+            company, line, departure, arrival, startStop, endStop, stopLat, stopLon)
+
+def parseCsv(csvPath):
+    return Timetable.fromColumns(*readCsvColumns(csvPath))
+
+def csvSignature(csvPath):
+    stat = os.stat(csvPath)
+    return cacheVersion, stat.st_size, stat.st_mtime_ns
+
+# Written to a unique temporary file first, so processes saving the cache at the same time
+# don't write into each other's file, and a reader never sees a half-written cache
+def saveCache(timetable, cachePath, signature):
+    file = tempfile.NamedTemporaryFile(dir=cachePath.parent, prefix=cachePath.name + '.', suffix='.tmp', delete=False)
+    try:
+        with file:
+            np.savez(file,
+                signature=np.array(signature, dtype=np.int64),
+                companyNames=np.array(timetable.companyNames, dtype=np.str_),
+                lineNames=np.array(timetable.lineNames, dtype=np.str_),
+                stopNames=np.array(timetable.stopNames, dtype=np.str_),
+                company=np.frombuffer(timetable.company, dtype=np.int32),
+                line=np.frombuffer(timetable.line, dtype=np.int32),
+                departure=np.frombuffer(timetable.departure, dtype=np.int32),
+                arrival=np.frombuffer(timetable.arrival, dtype=np.int32),
+                startStop=np.frombuffer(timetable.startStop, dtype=np.int32),
+                endStop=np.frombuffer(timetable.endStop, dtype=np.int32),
+                stopLat=np.frombuffer(timetable.stopLat, dtype=np.float64),
+                stopLon=np.frombuffer(timetable.stopLon, dtype=np.float64),
+                pattern=np.frombuffer(timetable.pattern, dtype=np.int32),
+                scanOrder=np.frombuffer(timetable.scanOrder, dtype=np.int32))
+        os.replace(file.name, cachePath)
+    except BaseException:
+        os.unlink(file.name)
+        raise
+
+def loadCache(cachePath, signature):
+    try:
+        with np.load(cachePath, allow_pickle=False) as cache:
+            if tuple(cache['signature'].tolist()) != signature:
+                return None
+            # Columns are saved already sorted, so no need to go through fromColumns
+            return Timetable(cache['companyNames'].tolist(), cache['lineNames'].tolist(), cache['stopNames'].tolist(),
+                             toArray(cache['company'], 'i'), toArray(cache['line'], 'i'),
+                             toArray(cache['departure'], 'i'), toArray(cache['arrival'], 'i'),
+                             toArray(cache['startStop'], 'i'), toArray(cache['endStop'], 'i'),
+                             toArray(cache['stopLat'], 'd'), toArray(cache['stopLon'], 'd'),
+                             toArray(cache['pattern'], 'i'), toArray(cache['scanOrder'], 'i'))
+    except Exception:
+        # Any broken cache (truncated, not a zip, missing arrays...) is a miss, it is rebuilt from the CSV
+        return None
+
+# Loads the timetable from the cache, rebuilding it when the CSV's size or mtime changed
+# Phases (cacheLoad, parse, build, cacheSave) are timed into stats
+def loadTimetable(csvPath, cachePath=None, stats=None):
+    if cachePath is None:
+        cachePath = csvPath.with_suffix('.npz')
+    if stats is None:
+        stats = Stats()
+    signature = csvSignature(csvPath)
+    with stats.phase('cacheLoad'):
+        timetable = loadCache(cachePath, signature)
+    if timetable is None:
+        with stats.phase('parse'):
+            columns = readCsvColumns(csvPath)
+        with stats.phase('build'):
+            timetable = Timetable.fromColumns(*columns)
+        with stats.phase('cacheSave'):
+            # The timetable is loaded even when the cache can't be written (e.g. a read-only directory)
+            try:
+                saveCache(timetable, cachePath, signature)
+            except OSError as error:
+                sys.stderr.write(f"Timetable cache not saved: {error}\n")
+    return timetable
+
+# Grid index over stop coordinates for nearest stop lookups
+# Coordinates are projected to meters (equirectangular around the mean latitude, exact enough at city scale)
+# and stops are bucketed into square cells of cellSize meters.
+# Footpaths (walking transfers between nearby stops) are computed once per (maxDistance, speed).
+class StopIndex:
+    def __init__(self, timetable, cellSize=250):
+        self.timetable = timetable
+        self.cellSize = cellSize
+        self.cosLat = math.cos(float(np.mean(timetable.stopLatRad))) if len(timetable.stopNames) else 1.0
+        self.x = (timetable.stopLonRad * self.cosLat * earthRadius).tolist()
+        self.y = (timetable.stopLatRad * earthRadius).tolist()
+        self.cells = dict()
+        for stop in range(len(timetable.stopNames)):
+            self.cells.setdefault(self.cell(self.x[stop], self.y[stop]), []).append(stop)
+        self.minCell = tuple(map(min, zip(*self.cells))) if self.cells else (0, 0)
+        self.maxCell = tuple(map(max, zip(*self.cells))) if self.cells else (0, 0)
+        self.footpathCache = dict()
+
+    def project(self, lat, lon):
+        return math.radians(lon) * self.cosLat * earthRadius, math.radians(lat) * earthRadius
+
+    def cell(self, x, y):
+        return int(x // self.cellSize), int(y // self.cellSize)
+
+    # Stops in the cells at Chebyshev distance ring from cell (cx, cy)
+    def ring(self, cx, cy, ring):
+        if ring == 0:
+            yield from self.cells.get((cx, cy), ())
+            return
+        for dx in range(-ring, ring + 1):
+            yield from self.cells.get((cx + dx, cy - ring), ())
+            yield from self.cells.get((cx + dx, cy + ring), ())
+        for dy in range(-ring + 1, ring):
+            yield from self.cells.get((cx - ring, cy + dy), ())
+            yield from self.cells.get((cx + ring, cy + dy), ())
+
+    # k nearest stops to a coordinate as a list of (distance in meters, stop id), nearest first
+    # Rings of cells are searched outwards until the next ring can't hold anything closer.
+    def nearest(self, lat, lon, k=1):
+        if not self.cells or k <= 0:
+            return []
+        x, y = self.project(lat, lon)
+        cx, cy = self.cell(x, y)
+        lastRing = max(cx - self.minCell[0], self.maxCell[0] - cx, cy - self.minCell[1], self.maxCell[1] - cy)
+        best = []
+        for ring in range(lastRing + 1):
+            for stop in self.ring(cx, cy, ring):
+                distance = math.hypot(self.x[stop] - x, self.y[stop] - y)
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, stop))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, stop))
+            # Cells of the next ring are at least ring * cellSize away
+            if len(best) == k and -best[0][0] <= ring * self.cellSize:
+                break
+        return sorted((-distance, stop) for distance, stop in best)
+
+    # Stops within radius meters of a coordinate as a list of (distance in meters, stop id), nearest first
+    def within(self, lat, lon, radius):
+        return self.withinProjected(*self.project(lat, lon), radius)
+
+    def withinProjected(self, x, y, radius):
+        cx, cy = self.cell(x, y)
+        reach = int(radius // self.cellSize) + 1
+        result = []
+        for ring in range(reach + 1):
+            for stop in self.ring(cx, cy, ring):
+                distance = math.hypot(self.x[stop] - x, self.y[stop] - y)
+                if distance <= radius:
+                    result.append((distance, stop))
+        result.sort()
+        return result
+
+    # footpaths[s] lists (stop, walking time in seconds) for every other stop within maxDistance of s
+    def footpaths(self, maxDistance=maxWalk, speed=walkingSpeed):
+        key = (maxDistance, speed)
+        if key not in self.footpathCache:
+            self.footpathCache[key] = [[(other, math.ceil(distance / speed))
+                                        for distance, other in self.withinProjected(self.x[stop], self.y[stop], maxDistance)
+                                        if other != stop]
+                                       for stop in range(len(self.x))]
+        return self.footpathCache[key]
 
 
 # Zad. 1
@@ -70,227 +382,905 @@ def addSecondsToTime(time, seconds):
 # np. nie można wsiąść do tramwaju przed tym jak przyjedzie na przystanek
 # oraz nie można cofać się w czasie.
 # Oprócz tego został dodany warunek, który kończy algorytm Dijkstry po znalezieniu celu.
+# Wszystkie wyszukiwania działają na kolumnach Timetable, identyfikatorach przystanków i czasie w sekundach.
 import heapq
+from bisect import bisect_left, bisect_right
+
+# Yields connections from stop that can be taken when being there at current_time.
+# Departures of a stop are sorted, so the scan starts at the first feasible one (binary search)
+# and only the first reachable trip of every pattern (line and end stop) is considered.
+def feasibleConnections(timetable, stop, current_time, stats=None):
+    pattern = timetable.pattern
+    arrival = timetable.arrival
+    remaining = timetable.patternCounts[stop]
+    seen = set()
+    first = bisect_left(timetable.departure, current_time, timetable.offsets[stop], timetable.offsets[stop + 1])
+    rejected = first - timetable.offsets[stop]
+    skipped = 0
+    for connection in range(first, timetable.offsets[stop + 1]):
+        if pattern[connection] in seen:
+            skipped += 1
+            continue
+        if arrival[connection] < current_time:
+            rejected += 1
+            continue
+        seen.add(pattern[connection])
+        yield connection
+        if len(seen) == remaining:
+            break
+    if stats is not None:
+        stats.edgesRelaxed += len(seen)
+        stats.edgesRejected += rejected
+        stats.tripsSkipped += skipped
+
+# Walk between two stops (fromStop is None when walking from the query coordinate), used as a path entry like a connection
+# previous is the entry by which fromStop was reached before the walk (it can differ from the stop's final entry,
+# e.g. when a later walk reached the stop earlier)
+Walk = namedtuple('Walk', ['fromStop', 'toStop', 'departure', 'arrival', 'previous'], defaults=(None,))
+
+def entryDeparture(timetable, entry):
+    return entry.departure if isinstance(entry, Walk) else timetable.departure[entry]
 
-def dijkstra(graph_dict, start, goal, current_time):
-    distances = {}
-    prev_nodes = {}
-    arrival_times = {}
-    mainGraphEntries = {}
-    for node in graph_dict.keys():
-        distances[node] = float('inf')
-        prev_nodes[node] = None
-        arrival_times[node] = None
-        mainGraphEntries[node] = None
+def entryArrival(timetable, entry):
+    return entry.arrival if isinstance(entry, Walk) else timetable.arrival[entry]
+
+# Walks back through the connections used to reach each stop, a Walk continues with its previous entry.
+# Returns stop names and connection indices or Walks (None for the start stop, named origin when starting from a coordinate).
+def reconstructPath(timetable, prev_connections, goal, origin=None):
+    path = []
+    resultEntries = []
+    curr_node = goal
+    connection = prev_connections[goal]
+    while curr_node is not None:
+        path.append(timetable.stopNames[curr_node])
+        resultEntries.append(connection)
+        if isinstance(connection, Walk):
+            curr_node = connection.fromStop
+            if curr_node is None:
+                path.append(origin)
+                resultEntries.append(None)
+            connection = connection.previous
+        else:
+            curr_node = timetable.startStop[connection] if connection is not None else None
+            if curr_node is not None:
+                connection = prev_connections[curr_node]
+    path.reverse()
+    resultEntries.reverse()
+    return path, resultEntries
+
+# Every entry of a path leaves from the stop the previous one arrived at, not before it arrived there,
+# and a walk leaves right when the previous entry arrived (walks start after an arrival, there is no waiting before them)
+def consistentPath(timetable, path, entries):
+    stopIds = timetable.stopIds
+    for i in range(1, len(entries)):
+        entry = entries[i]
+        if isinstance(entry, Walk):
+            fromStop, toStop = entry.fromStop, entry.toStop
+        else:
+            fromStop, toStop = timetable.startStop[entry], timetable.endStop[entry]
+        if toStop != stopIds.get(path[i]) or (fromStop is not None and fromStop != stopIds.get(path[i - 1])):
+            return False
+        if i > 1 and entryDeparture(timetable, entry) < entryArrival(timetable, entries[i - 1]):
+            return False
+        if i > 1 and isinstance(entry, Walk) and entry.departure != entryArrival(timetable, entries[i - 1]):
+            return False
+    return True
+
+def dijkstra(timetable, start, goal, current_time, stats=None):
+    start = timetable.stopIds[start]
+    goal = timetable.stopIds[goal]
+    arrival = timetable.arrival
+    endStop = timetable.endStop
+
+    distances = [float('inf')] * len(timetable.stopNames)
+    prev_connections = [None] * len(timetable.stopNames)
+    arrival_times = [None] * len(timetable.stopNames)
     distances[start] = 0
     arrival_times[start] = current_time
+    pushes, pops, stalePops = 1, 0, 0
 
     pq = [(0, start)]
 
     while pq:
         curr_dist, curr_node = heapq.heappop(pq)
+        pops += 1
         if curr_node == goal:
             break
 
         if curr_dist > distances[curr_node]:
+            stalePops += 1
             continue
-        for row in graph_dict[curr_node]:
-            neighbor = row[4]
-            weight = getTimeSeconds(row[3]) - getTimeSeconds(arrival_times[curr_node])
-            if weight < 0 or getTimeSeconds(arrival_times[curr_node]) > getTimeSeconds(row[2]):
-                continue
-            
+        curr_time = arrival_times[curr_node]
+        for connection in feasibleConnections(timetable, curr_node, curr_time, stats):
+            neighbor = endStop[connection]
+            weight = arrival[connection] - curr_time
+
             new_dist = curr_dist + weight
             if new_dist < distances[neighbor]:
                 distances[neighbor] = new_dist
-                prev_nodes[neighbor] = curr_node
-                arrival_times[neighbor] = addSecondsToTime(arrival_times[curr_node], weight)
-                mainGraphEntries[neighbor] = row
+                prev_connections[neighbor] = connection
+                arrival_times[neighbor] = arrival[connection]
                 heapq.heappush(pq, (new_dist, neighbor))
+                pushes += 1
 
-    path = []
-    resultEntries = []
-    curr_node = goal
-    while curr_node is not None:
-            path.append(curr_node)
-            resultEntries.append(mainGraphEntries[curr_node])
-            curr_node = prev_nodes[curr_node]
-    path.reverse()
-    resultEntries.reverse()
-
+    if stats is not None:
+        stats.pushes += pushes
+        stats.pops += pops
+        stats.stalePops += stalePops
+    path, resultEntries = reconstructPath(timetable, prev_connections, goal)
     return distances[goal], path, resultEntries
 
+# Connection Scan Algorithm (earliest arrival)
+# Scans all connections in order of departure once, without a priority queue.
+# Stops as soon as the remaining connections depart after the best arrival at goal.
+# With footpaths (StopIndex.footpaths) every stop reached by a connection can be left on foot to a nearby stop.
+def csa(timetable, start, goal, current_time, stats=None, footpaths=None):
+    start = timetable.stopIds[start]
+    goal = timetable.stopIds[goal]
+    arrival_times, prev_connections = scanConnections(timetable, {start: (current_time, None)}, goal, current_time, footpaths, stats)
+    path, resultEntries = reconstructPath(timetable, prev_connections, goal)
+    return arrival_times[goal] - current_time, path, resultEntries
+
+# CSA from a coordinate: the k nearest stops within maxDistance are all origins,
+# reached on foot, and walking transfers between stops are allowed.
+# The first path element is the coordinate, the first entry after None is the Walk to the origin stop.
+def csaFromCoordinates(timetable, lat, lon, goal, current_time, k=5, maxDistance=1000, stats=None):
+    index = timetable.stopIndex()
+    origins = dict()
+    for distance, stop in index.nearest(lat, lon, k):
+        if distance <= maxDistance:
+            reached = current_time + math.ceil(distance / walkingSpeed)
+            origins[stop] = (reached, Walk(None, stop, current_time, reached))
+    goal = timetable.stopIds[goal]
+    arrival_times, prev_connections = scanConnections(timetable, origins, goal, current_time, index.footpaths(), stats)
+    path, resultEntries = reconstructPath(timetable, prev_connections, goal, origin=f"({lat}, {lon})")
+    return arrival_times[goal] - current_time, path, resultEntries
+
+# origins maps stop id to (arrival time, entry it was reached by)
+# Footpaths are only taken from origins and from stops reached by a connection, walks aren't chained:
+# every Walk keeps the connection (or origin entry) it starts after as its previous entry.
+def scanConnections(timetable, origins, goal, current_time, footpaths=None, stats=None):
+    departure = timetable.departure
+    arrival = timetable.arrival
+    startStop = timetable.startStop
+    endStop = timetable.endStop
+    scanOrder = timetable.scanOrder
+
+    arrival_times = [float('inf')] * len(timetable.stopNames)
+    prev_connections = [None] * len(timetable.stopNames)
+    # Earliest arrival at every stop by a connection, walks start from these
+    ride_times = [float('inf')] * len(timetable.stopNames)
+
+    def walkFrom(stop, curr_time, previous):
+        for other, seconds in footpaths[stop]:
+            reached = curr_time + seconds
+            if reached < arrival_times[other]:
+                arrival_times[other] = reached
+                prev_connections[other] = Walk(stop, other, curr_time, reached, previous)
+
+    for stop, (reached, entry) in origins.items():
+        arrival_times[stop] = reached
+        prev_connections[stop] = entry
+    if footpaths is not None:
+        for stop, (reached, entry) in origins.items():
+            walkFrom(stop, reached, entry)
+
+    first = bisect_left(scanOrder, current_time, key=departure.__getitem__)
+    relaxed, rejected = 0, 0
+    for i in range(first, len(scanOrder)):
+        connection = scanOrder[i]
+        if departure[connection] >= arrival_times[goal]:
+            break
+        curr_time = arrival_times[startStop[connection]]
+        if curr_time > departure[connection] or arrival[connection] < curr_time:
+            rejected += 1
+            continue
+        relaxed += 1
+        neighbor = endStop[connection]
+        if arrival[connection] < arrival_times[neighbor]:
+            arrival_times[neighbor] = arrival[connection]
+            prev_connections[neighbor] = connection
+        # A stop reached earlier on foot can still be worth walking away from after arriving by a vehicle
+        if footpaths is not None and arrival[connection] < ride_times[neighbor]:
+            ride_times[neighbor] = arrival[connection]
+            walkFrom(neighbor, arrival[connection], connection)
+
+    if stats is not None:
+        stats.edgesRelaxed += relaxed
+        stats.edgesRejected += rejected
+    return arrival_times, prev_connections
+
+# Round-based Pareto search for arrival time and number of transfers (RAPTOR-style)
+# Round k computes the earliest arrival at every stop using at most k boardings.
+# Only stops improved in the previous round are boarded from, the boarded lines are then followed
+# in order of arrival. The CSV has no trip ids, so like in astarTransfer staying on the same line
+# (even waiting for its next vehicle) is not a transfer.
+# Returns the Pareto set as a list of (transfers, (weight, path, entries)), fewest transfers first.
+# maxTransfers=None doesn't limit the rounds: they end when no stop improves, and a Pareto-optimal journey
+# never visits a stop twice, so there are at most as many rounds as stops.
+def raptor(timetable, start, goal, current_time, maxTransfers=None, stats=None):
+    start = timetable.stopIds[start]
+    goal = timetable.stopIds[goal]
+    if start == goal:
+        return [(0, (0, [timetable.stopNames[start]], [None]))]
+    stopCount = len(timetable.stopNames)
+    if maxTransfers is None:
+        maxTransfers = stopCount
+    line = timetable.line
+    arrival = timetable.arrival
+    endStop = timetable.endStop
+
+    prev_arrivals = [float('inf')] * stopCount
+    prev_arrivals[start] = current_time
+    marked = [start]
+    # Per round: connection that set the stop's label (None if copied from the previous round)
+    # and the previous connection of the same ride (None if boarded in that round)
+    round_connections = [[None] * stopCount]
+    ride_parents = [dict()]
+    journeys = []
+    if stats is None:
+        stats = Stats()
+
+    for k in range(1, maxTransfers + 2):
+        arrivals = prev_arrivals[:]
+        stop_connections = [None] * stopCount
+        parents = dict()
+        # Earliest arrival of a line at a stop in this round, key: line * stopCount + stop
+        riding = dict()
+        pq = []
+
+        def take(connection, parent):
+            if arrival[connection] >= arrivals[goal]:
+                return
+            key = line[connection] * stopCount + endStop[connection]
+            if arrival[connection] >= riding.get(key, float('inf')):
+                return
+            riding[key] = arrival[connection]
+            parents[connection] = parent
+            heapq.heappush(pq, (arrival[connection], connection))
+            stats.pushes += 1
+            neighbor = endStop[connection]
+            if arrival[connection] < arrivals[neighbor]:
+                arrivals[neighbor] = arrival[connection]
+                stop_connections[neighbor] = connection
+
+        for stop in marked:
+            for connection in feasibleConnections(timetable, stop, prev_arrivals[stop], stats):
+                take(connection, None)
+        while pq:
+            curr_time, connection = heapq.heappop(pq)
+            stats.pops += 1
+            if curr_time >= arrivals[goal]:
+                break
+            curr_line = line[connection]
+            curr_node = endStop[connection]
+            if riding[curr_line * stopCount + curr_node] < curr_time:
+                stats.stalePops += 1
+                continue
+            for next_connection in feasibleConnections(timetable, curr_node, curr_time, stats):
+                if line[next_connection] == curr_line:
+                    take(next_connection, connection)
+
+        round_connections.append(stop_connections)
+        ride_parents.append(parents)
+        if arrivals[goal] < prev_arrivals[goal]:
+            journeys.append((k - 1, reconstructRounds(timetable, round_connections, ride_parents, k, goal, current_time)))
+        marked = [stop for stop in range(stopCount) if arrivals[stop] < prev_arrivals[stop]]
+        if not marked:
+            break
+        prev_arrivals = arrivals
+    return journeys
+
+def reconstructRounds(timetable, round_connections, ride_parents, k, goal, current_time):
+    connections = []
+    stop = goal
+    while True:
+        while k > 0 and round_connections[k][stop] is None:
+            k -= 1
+        if k == 0:
+            break
+        connection = round_connections[k][stop]
+        while connection is not None:
+            connections.append(connection)
+            connection = ride_parents[k][connection]
+        stop = timetable.startStop[connections[-1]]
+        k -= 1
+    connections.reverse()
+    path = [timetable.stopNames[stop]] + [timetable.stopNames[timetable.endStop[connection]] for connection in connections]
+    return timetable.arrival[connections[-1]] - current_time, path, [None] + connections
+
+# Profile query: all non-dominated (departure, arrival) journeys leaving start between windowStart and windowEnd
+# Connections are scanned once by decreasing departure (profile Connection Scan). Every stop keeps a list of
+# (departure, arrival at goal, connection) with decreasing departure and strictly decreasing arrival,
+# so the best continuation after arriving at a stop is found by binary search.
+# Journeys from the window can't arrive later than the earliest arrival when leaving at windowEnd,
+# connections arriving after it are skipped.
+# Returns a list of (departure, arrival, (weight, path, entries)) ordered by departure, weight is the travel time.
+def profileQuery(timetable, start, goal, windowStart, windowEnd, stats=None):
+    latestArrival = csa(timetable, start, goal, windowEnd)[0] + windowEnd
+    start = timetable.stopIds[start]
+    goal = timetable.stopIds[goal]
+    departure = timetable.departure
+    arrival = timetable.arrival
+    startStop = timetable.startStop
+    endStop = timetable.endStop
+    scanOrder = timetable.scanOrder
+
+    profiles = [[] for _ in timetable.stopNames]
+    # Negated departures of profiles, ascending, for bisect
+    profileKeys = [[] for _ in timetable.stopNames]
+    def arrivalAfter(stop, current_time):
+        index = bisect_right(profileKeys[stop], -current_time) - 1
+        return profiles[stop][index] if index >= 0 else None
+
+    def addToProfile(profile, keys, dep, reached, connection):
+        if profile and reached >= profile[-1][1]:
+            return
+        if profile and profile[-1][0] == dep:
+            profile.pop()
+            if keys is not None:
+                keys.pop()
+        profile.append((dep, reached, connection))
+        if keys is not None:
+            keys.append(-dep)
+
+    windowProfile = []
+    first = bisect_left(scanOrder, windowStart, key=departure.__getitem__)
+    last = bisect_right(scanOrder, latestArrival, key=departure.__getitem__)
+    relaxed, rejected = 0, 0
+    for i in range(last - 1, first - 1, -1):
+        connection = scanOrder[i]
+        stop = startStop[connection]
+        if arrival[connection] > latestArrival or arrival[connection] < departure[connection] or stop == goal:
+            rejected += 1
+            continue
+        relaxed += 1
+        neighbor = endStop[connection]
+        if neighbor == goal:
+            reached = arrival[connection]
+        else:
+            entry = arrivalAfter(neighbor, arrival[connection])
+            if entry is None:
+                continue
+            reached = entry[1]
+        # Departures from start after the window can't dominate the ones inside it,
+        # so the journeys from the window are kept in a separate profile
+        if stop == start and departure[connection] <= windowEnd:
+            addToProfile(windowProfile, None, departure[connection], reached, connection)
+        addToProfile(profiles[stop], profileKeys[stop], departure[connection], reached, connection)
+
+    if stats is not None:
+        stats.edgesRelaxed += relaxed
+        stats.edgesRejected += rejected
+
+    journeys = []
+    for dep, _, connection in reversed(windowProfile):
+        connections = [connection]
+        while endStop[connections[-1]] != goal:
+            connections.append(arrivalAfter(endStop[connections[-1]], arrival[connections[-1]])[2])
+        path = [timetable.stopNames[start]] + [timetable.stopNames[endStop[c]] for c in connections]
+        journeys.append((dep, arrival[connections[-1]], (arrival[connections[-1]] - dep, path, [None] + connections)))
+    return journeys
+
 def manhattan_distance(a, b):
     return sum([abs(x-y) for x,y in zip(a,b)])
 
 def euclidean_distance(a, b):
    return math.sqrt(sum([(x - y) ** 2 for x, y in zip(a, b)]))
 
-def astarTime(graph_dict, start, goal, current_time, heuristic_fn):
-    distances = {}
-    prev_nodes = {}
-    arrival_times = {}
-    mainGraphEntries = {}
-    for node in graph_dict.keys():
-        distances[node] = float('inf')
-        prev_nodes[node] = None
-        arrival_times[node] = None
-        mainGraphEntries[node] = None
+# Haversine distance in meters from every stop to goal, vectorized over all stops
+def haversineDistances(timetable, goal):
+    dLat = timetable.stopLatRad - timetable.stopLatRad[goal]
+    dLon = timetable.stopLonRad - timetable.stopLonRad[goal]
+    a = np.sin(dLat / 2) ** 2 + np.cos(timetable.stopLatRad) * np.cos(timetable.stopLatRad[goal]) * np.sin(dLon / 2) ** 2
+    return 2 * earthRadius * np.arcsin(np.sqrt(a))
+
+# Lower bound of travel time in seconds from every stop to goal:
+# no vehicle covers the distance faster than the fastest connection in the timetable.
+# With zero-duration connections between different places there is no such speed, rideTimeBounds is used then.
+def haversineHeuristic(timetable, goal):
+    if timetable.maxSpeed == math.inf:
+        return rideTimeBounds(timetable, goal)
+    return (haversineDistances(timetable, goal) / timetable.maxSpeed).tolist()
+
+# Lower bound of travel time in seconds from every stop to goal, valid for any timetable (also minute resolution):
+# Dijkstra from goal backwards over stop pairs weighted by their shortest connection, waiting ignored.
+# Every connection takes at least that long, so the bound is consistent. inf where goal can't be reached.
+# The last boundCacheSize goals are cached.
+def rideTimeBounds(timetable, goal):
+    cache = timetable.boundCache
+    if goal in cache:
+        cache.move_to_end(goal)
+        return cache[goal]
+    offsets, startStops, durations = timetable.stopGraph()
+    bounds = [float('inf')] * len(timetable.stopNames)
+    bounds[goal] = 0
+    pq = [(0, goal)]
+    while pq:
+        curr_dist, curr_node = heapq.heappop(pq)
+        if curr_dist > bounds[curr_node]:
+            continue
+        for i in range(offsets[curr_node], offsets[curr_node + 1]):
+            neighbor = startStops[i]
+            new_dist = curr_dist + durations[i]
+            if new_dist < bounds[neighbor]:
+                bounds[neighbor] = new_dist
+                heapq.heappush(pq, (new_dist, neighbor))
+    cache[goal] = bounds
+    if len(cache) > boundCacheSize:
+        cache.popitem(last=False)
+    return bounds
+
+# A* over arrival time, heuristic_fn(timetable, goal) returns a lower bound of remaining time for every stop
+def astarTime(timetable, start, goal, current_time, heuristic_fn=haversineHeuristic, stats=None):
+    start = timetable.stopIds[start]
+    goal = timetable.stopIds[goal]
+    arrival = timetable.arrival
+    endStop = timetable.endStop
+    heuristic = heuristic_fn(timetable, goal)
+
+    distances = [float('inf')] * len(timetable.stopNames)
+    prev_connections = [None] * len(timetable.stopNames)
+    arrival_times = [None] * len(timetable.stopNames)
     distances[start] = 0
     arrival_times[start] = current_time
+    pushes, pops, stalePops = 1, 0, 0
 
-    pq = [(0, start)]
+    pq = [(heuristic[start], 0, start)]
 
     while pq:
-        curr_dist, curr_node = heapq.heappop(pq)
+        _, curr_dist, curr_node = heapq.heappop(pq)
+        pops += 1
         if curr_node == goal:
             break
 
         if curr_dist > distances[curr_node]:
+            stalePops += 1
             continue
-        for row in graph_dict[curr_node]:
-            neighbor = row[4]
-            # Verify whether going back in time or entering a line before it arrives
-            secondsOfTravel = getTimeSeconds(row[3]) - getTimeSeconds(arrival_times[curr_node])
-            if secondsOfTravel < 0 or getTimeSeconds(arrival_times[curr_node]) > getTimeSeconds(row[2]):
-                continue
-            
-            weight = secondsOfTravel
-
-            weight += heuristic_fn((row[5], row[6]),(row[7], row[8]))*25000 #!!!!
-
-            new_dist = curr_dist + weight
+        curr_time = arrival_times[curr_node]
+        for connection in feasibleConnections(timetable, curr_node, curr_time, stats):
+            neighbor = endStop[connection]
+            new_dist = curr_dist + arrival[connection] - curr_time
             if new_dist < distances[neighbor]:
                 distances[neighbor] = new_dist
-                prev_nodes[neighbor] = curr_node
-                arrival_times[neighbor] = row[3]
-                mainGraphEntries[neighbor] = row
-                heapq.heappush(pq, (new_dist, neighbor))
-
-    path = []
-    resultEntries = []
-    curr_node = goal
-    while curr_node is not None:
-            path.append(curr_node)
-            resultEntries.append(mainGraphEntries[curr_node])
-            curr_node = prev_nodes[curr_node]
-    path.reverse()
-    resultEntries.reverse()
+                prev_connections[neighbor] = connection
+                arrival_times[neighbor] = arrival[connection]
+                heapq.heappush(pq, (new_dist + heuristic[neighbor], new_dist, neighbor))
+                pushes += 1
 
+    if stats is not None:
+        stats.pushes += pushes
+        stats.pops += pops
+        stats.stalePops += stalePops
+    path, resultEntries = reconstructPath(timetable, prev_connections, goal)
     return distances[goal], path, resultEntries
 
-def astarTransfer(graph_dict, start, goal, current_time, heuristic_fn):
-    distances = {}
-    prev_nodes = {}
-    prev_lines = {}
-    arrival_times = {}
-    mainGraphEntries = {}
-    for node in graph_dict.keys():
-        distances[node] = float('inf')
-        prev_nodes[node] = None
-        arrival_times[node] = None
-        mainGraphEntries[node] = None
-        prev_lines[node] = None
+def astarTransfer(timetable, start, goal, current_time, heuristic_fn, stats=None):
+    start = timetable.stopIds[start]
+    goal = timetable.stopIds[goal]
+    line = timetable.line
+    arrival = timetable.arrival
+    endStop = timetable.endStop
+    stopLat = timetable.stopLat
+    stopLon = timetable.stopLon
+
+    distances = [float('inf')] * len(timetable.stopNames)
+    prev_connections = [None] * len(timetable.stopNames)
+    prev_lines = [None] * len(timetable.stopNames)
+    arrival_times = [None] * len(timetable.stopNames)
     distances[start] = 0
     arrival_times[start] = current_time
+    pushes, pops, stalePops = 1, 0, 0
 
     pq = [(0, start)]
 
     while pq:
         curr_dist, curr_node = heapq.heappop(pq)
+        pops += 1
         if curr_node == goal:
             break
 
         if curr_dist > distances[curr_node]:
+            stalePops += 1
             continue
-        for row in graph_dict[curr_node]:
-            neighbor = row[4]
-            # Verify whether going back in time or entering a line before it arrives
-            secondsOfTravel = getTimeSeconds(row[3]) - getTimeSeconds(arrival_times[curr_node])
-            if secondsOfTravel < 0 or getTimeSeconds(arrival_times[curr_node]) > getTimeSeconds(row[2]):
-                continue
+        curr_time = arrival_times[curr_node]
+        curr_coords = (stopLat[curr_node], stopLon[curr_node])
+        for connection in feasibleConnections(timetable, curr_node, curr_time, stats):
+            neighbor = endStop[connection]
+            secondsOfTravel = arrival[connection] - curr_time
 
             if prev_lines[curr_node] == None:
                 weight = 100
-            elif prev_lines[curr_node] != row[1]:
+            elif prev_lines[curr_node] != line[connection]:
                 weight = 100
             else:
                 weight = 0
 
-            weight += heuristic_fn((row[5], row[6]),(row[7], row[8]))*1500 #!!!!
+            weight += heuristic_fn(curr_coords, (stopLat[neighbor], stopLon[neighbor]))*1500 #!!!!
 
             new_dist = curr_dist + weight
             if new_dist < distances[neighbor]:
                 distances[neighbor] = new_dist
-                prev_nodes[neighbor] = curr_node
-                prev_lines[neighbor] = row[1]
-                arrival_times[neighbor] = row[3]
-                mainGraphEntries[neighbor] = row
+                prev_connections[neighbor] = connection
+                prev_lines[neighbor] = line[connection]
+                arrival_times[neighbor] = arrival[connection]
                 heapq.heappush(pq, (new_dist, neighbor))
+                pushes += 1
 
-    path = []
-    resultEntries = []
-    curr_node = goal
-    while curr_node is not None:
-            path.append(curr_node)
-            resultEntries.append(mainGraphEntries[curr_node])
-            curr_node = prev_nodes[curr_node]
-    path.reverse()
-    resultEntries.reverse()
-
+    if stats is not None:
+        stats.pushes += pushes
+        stats.pops += pops
+        stats.stalePops += stalePops
+    path, resultEntries = reconstructPath(timetable, prev_connections, goal)
     return distances[goal], path, resultEntries
 
 
-def presentResult(result, startTimeArg, executionTime):
+def presentResult(result, startTimeArg, executionTime, timetable, stats=None):
     weightTraveled = result[0]
     path = result[1]
-    graphEntries = result[2]
-    graphEntries.pop(0)
-    print(f"Time of arrival at {path[0]} stop: {startTimeArg}")
+    graphEntries = result[2][1:]
+    lines = [None if isinstance(entry, Walk) else timetable.lineNames[timetable.line[entry]] for entry in graphEntries]
+    print(f"Time of arrival at {path[0]} stop: {formatTime(startTimeArg)}")
     prevLine = None
-    firstStop = True
     for i in range(0, len(path)-1):
-        if prevLine != graphEntries[i][1]:
-            if not firstStop:
-                print(f"Left line {prevLine} on {path[i]} stop at time {graphEntries[i-1][3]}")
-            prevLine = graphEntries[i][1]
-            print(f"Entered line {graphEntries[i][1]} on {path[i]} stop at time: {graphEntries[i][2]}")
-        firstStop = False
-    print(f"Last stop - {path[len(path)-1]} leaving line {graphEntries[len(graphEntries)-1][1]} at time {graphEntries[len(graphEntries)-1][3]}")
+        if prevLine != lines[i] or lines[i] is None:
+            if prevLine is not None:
+                print(f"Left line {prevLine} on {path[i]} stop at time {formatTime(entryArrival(timetable, graphEntries[i-1]))}")
+            prevLine = lines[i]
+            if lines[i] is None:
+                print(f"Walked from {path[i]} to {path[i+1]} between {formatTime(graphEntries[i].departure)} and {formatTime(graphEntries[i].arrival)}")
+            else:
+                print(f"Entered line {lines[i]} on {path[i]} stop at time: {formatTime(timetable.departure[graphEntries[i]])}")
+    if not graphEntries:
+        print(f"Last stop - {path[0]} is the starting stop, no travel needed")
+    elif lines[len(lines)-1] is None:
+        print(f"Last stop - {path[len(path)-1]} reached on foot at time {formatTime(graphEntries[len(graphEntries)-1].arrival)}")
+    else:
+        print(f"Last stop - {path[len(path)-1]} leaving line {lines[len(lines)-1]} at time {formatTime(timetable.arrival[graphEntries[len(graphEntries)-1]])}")
     sys.stderr.write(f"Total commute weight: {weightTraveled}\n")
     sys.stderr.write(f"Code execution time: {executionTime}\n")
+    if stats is not None:
+        sys.stderr.write(f"Search stats: {stats}\n")
 
 
-while True:
-    startArg = input("Input start stop: ")
-    endArg = input("Input end stop: ")
-    optModeArg = input("Input A* mode of operation ('t' - optimize time, 'p' - optimize transfers): ")
-    hr = int(input("Input hour of arrival at start stop: "))
-    min = int(input("Input minute of arrival at start stop: "))
-    startTimeArg = time(hour=hr, minute=min)
+# Queries outside of the interactive loop (server, batch)
+# Every mode returns a list of (transfers, result), only raptor can return more than one journey.
+modes = {
+    'dijkstra': lambda timetable, start, goal, current_time, stats=None: [(None, dijkstra(timetable, start, goal, current_time, stats=stats))],
+    'csa': lambda timetable, start, goal, current_time, stats=None: [(None, csa(timetable, start, goal, current_time, stats=stats))],
+    'astar_time': lambda timetable, start, goal, current_time, stats=None: [(None, astarTime(timetable, start, goal, current_time, stats=stats))],
+    'astar_transfer': lambda timetable, start, goal, current_time, stats=None: [(None, astarTransfer(timetable, start, goal, current_time, euclidean_distance, stats=stats))],
+    'raptor': lambda timetable, start, goal, current_time, stats=None: raptor(timetable, start, goal, current_time, stats=stats),
+}
 
+# LRU cache of query results keyed by (start, goal, mode, departure time bucket)
+# A cached result computed for an earlier time of the same bucket is reused only if all of its journeys
+# depart at or after the requested time: arrival can't get earlier by starting later, so the journeys
+# are still optimal and only their weight (time since the requested start) is shifted.
+# Entries are dropped when a different (reloaded) timetable is queried.
+class RouteCache:
+    # astar_transfer is a heuristic, a cached answer could differ from a fresh search
+    exactModes = {'dijkstra', 'csa', 'astar_time', 'raptor'}
 
+    def __init__(self, maxSize=1024, bucketSeconds=900):
+        self.maxSize = maxSize
+        self.bucketSeconds = bucketSeconds
+        self.entries = OrderedDict()
+        self.timetable = None
+        self.hits = 0
+        self.misses = 0
 
-    print()
-    print("Calculating Dijkstra - time...")
-    start = timer()
-    result = dijkstra(mainGraph, startArg, endArg, startTimeArg)
-    end = timer()
+    def clear(self):
+        self.entries.clear()
 
-    presentResult(result, startTimeArg, end - start)
-    print()
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
 
+    def query(self, timetable, start, goal, current_time, mode, stats=None):
+        if mode not in self.exactModes or self.maxSize <= 0:
+            return modes[mode](timetable, start, goal, current_time, stats), False
+        if timetable is not self.timetable:
+            self.clear()
+            self.timetable = timetable
 
-    print(f"Calculating A* - {'time' if optModeArg == 't' else 'transfers'} with euclidean heuristic...")
-    
-    if optModeArg == 't':
-        start = timer()
-        result = astarTime(mainGraph, startArg, endArg, startTimeArg, euclidean_distance)
-        end = timer()
-    else:
-        start = timer()
-        result = astarTransfer(mainGraph, startArg, endArg, startTimeArg, euclidean_distance)
-        end = timer()
+        key = (start, goal, mode, current_time // self.bucketSeconds)
+        entry = self.entries.get(key)
+        if entry is not None:
+            query_time, journeys = entry
+            if query_time <= current_time and all(self.firstDeparture(result) >= current_time for _, result in journeys):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                shift = current_time - query_time
+                return [(transfers, (weight - shift if len(entries) > 1 else weight, path, entries))
+                        for transfers, (weight, path, entries) in journeys], True
+
+        self.misses += 1
+        journeys = modes[mode](timetable, start, goal, current_time, stats)
+        self.entries[key] = (current_time, journeys)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+        return journeys, False
+
+    def firstDeparture(self, result):
+        entries = result[2]
+        return entryDeparture(self.timetable, entries[1]) if len(entries) > 1 else float('inf')
+
+# Groups connections of a result into legs ridden on one line, like presentResult
+# Walks are legs of their own with line None, origin names the start of a walk from a coordinate
+def resultLegs(timetable, entries, origin=None):
+    legs = []
+    for connection in entries[1:]:
+        if isinstance(connection, Walk):
+            legs.append({
+                'line': None,
+                'from': timetable.stopNames[connection.fromStop] if connection.fromStop is not None else origin,
+                'departure': formatTime(connection.departure),
+                'to': timetable.stopNames[connection.toStop],
+                'arrival': formatTime(connection.arrival),
+            })
+            continue
+        line = timetable.lineNames[timetable.line[connection]]
+        if not legs or legs[-1]['line'] != line:
+            legs.append({
+                'line': line,
+                'from': timetable.stopNames[timetable.startStop[connection]],
+                'departure': formatTime(timetable.departure[connection]),
+            })
+        legs[-1]['to'] = timetable.stopNames[timetable.endStop[connection]]
+        legs[-1]['arrival'] = formatTime(timetable.arrival[connection])
+    return legs
+
+# Query: {"start": stop, "end": stop, "time": "HH:MM[:SS]", "mode": one of modes}
+# or, to start from a coordinate, {"lat": ..., "lon": ..., "end": stop, "time": ...} (answered with csa, not cached)
+# Field types of a query, anything else (e.g. a number as time) is answered with an error, not an exception
+def checkQuery(query):
+    if not isinstance(query, dict):
+        raise ValueError("Query has to be a JSON object")
+    for field in ('start', 'end', 'time', 'mode'):
+        if field in query and not isinstance(query[field], str):
+            raise ValueError(f"{field} has to be a string")
+    for field in ('lat', 'lon'):
+        if field in query and (isinstance(query[field], bool) or not isinstance(query[field], (int, float, str))):
+            raise ValueError(f"{field} has to be a number")
+
+def answerQuery(timetable, query, cache=None):
+    checkQuery(query)
+    coordinates = 'start' not in query and 'lat' in query and 'lon' in query
+    mode = query.get('mode', 'csa' if coordinates else 'dijkstra')
+    if mode not in modes:
+        raise ValueError(f"Unknown mode: {mode}")
+    if coordinates and mode != 'csa':
+        raise ValueError(f"Queries from a coordinate are only answered with csa, not {mode}")
+    for stop in (query['end'],) if coordinates else (query['start'], query['end']):
+        if stop not in timetable.stopIds:
+            raise ValueError(f"Unknown stop: {stop}")
+    startTime = parseTime(query['time'])
+
+    stats = Stats()
+    with stats.phase('search'):
+        if coordinates:
+            journeys, cacheHit = [(None, csaFromCoordinates(timetable, float(query['lat']), float(query['lon']), query['end'], startTime, stats=stats))], False
+        elif cache is not None:
+            journeys, cacheHit = cache.query(timetable, query['start'], query['end'], startTime, mode, stats)
+        else:
+            journeys, cacheHit = modes[mode](timetable, query['start'], query['end'], startTime, stats), False
+
+    start = {'lat': float(query['lat']), 'lon': float(query['lon'])} if coordinates else query['start']
+    response = {'start': start, 'end': query['end'], 'time': formatTime(startTime), 'mode': mode,
+                'executionTime': stats.timings['search'], 'cacheHit': cacheHit, 'stats': stats.toDict(), 'journeys': []}
+    for transfers, (weight, path, entries) in journeys:
+        if weight == float('inf'):
+            continue
+        legs = resultLegs(timetable, entries, path[0])
+        response['journeys'].append({
+            'weight': weight,
+            'transfers': transfers if transfers is not None else max(len([leg for leg in legs if leg['line'] is not None]) - 1, 0),
+            'arrival': legs[-1]['arrival'] if legs else formatTime(startTime),
+            'path': path,
+            'legs': legs,
+        })
+    return response
+
+# Worker processes get the timetable once, when the pool is created.
+# With fork it is inherited from the parent instead of being pickled.
+workerTimetable = None
+workerCache = None
+
+def initWorker(timetable, cacheSize, cacheBucket):
+    global workerTimetable, workerCache
+    workerTimetable = timetable
+    workerCache = RouteCache(cacheSize, cacheBucket)
+
+def workerAnswer(query):
+    try:
+        return answerQuery(workerTimetable, query, workerCache)
+    except (KeyError, ValueError) as error:
+        return {'error': str(error)}
+
+# Every worker has its own RouteCache, cacheSize 0 disables caching
+def createPool(timetable, workers=None, cacheSize=1024, cacheBucket=900):
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initWorker, initargs=(timetable, cacheSize, cacheBucket))
+    # Start all workers now, before any server threads exist
+    pool.submit(int).result()
+    return pool
+
+class RouteRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(query, dict):
+                raise ValueError("Query has to be a JSON object")
+        except ValueError as error:
+            self.sendJson(400, {'error': str(error)})
+            return
+        response = self.server.pool.submit(workerAnswer, query).result()
+        self.sendJson(400 if 'error' in response else 200, response)
+
+    def sendJson(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Answers POSTed JSON queries, the routing itself runs on a pool of worker processes
+def serve(timetable, host='127.0.0.1', port=8000, workers=None, cacheSize=1024, cacheBucket=900):
+    with createPool(timetable, workers, cacheSize, cacheBucket) as pool:
+        with ThreadingHTTPServer((host, port), RouteRequestHandler) as server:
+            server.pool = pool
+            print(f"Serving routes on http://{host}:{port}")
+            server.serve_forever()
+
+
+# Batch queries: CSV (start,end,time,mode header) or JSONL file, one query per row
+# A JSONL line that isn't valid JSON is kept as its text, it gets an error response like any other bad query
+def readQueries(path):
+    with open(path) as file:
+        if pathlib.Path(path).suffix == '.jsonl':
+            return [parseQueryLine(line) for line in file if line.strip()]
+        return [dict(row) for row in csv.DictReader(file)]
+
+def parseQueryLine(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line.strip()
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if values else None
+
+def latencySummary(responses):
+    latencies = dict()
+    cacheHits = dict()
+    errors = 0
+    for response in responses:
+        if 'error' in response:
+            errors += 1
+        else:
+            latencies.setdefault(response['mode'], list()).append(response['executionTime'])
+            cacheHits[response['mode']] = cacheHits.get(response['mode'], 0) + response['cacheHit']
+    summary = {mode: {'queries': len(values), 'cacheHits': cacheHits[mode],
+                      'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99)}
+               for mode, values in latencies.items()}
+    return summary, errors
+
+# In a batch one failing query must not abort the others, so any exception becomes an error response
+def batchAnswer(query):
+    try:
+        return workerAnswer(query)
+    except Exception as error:
+        return {'error': f"{type(error).__name__}: {error}"}
+
+# Answers all queries on a pool of worker processes sharing the loaded timetable,
+# writes the responses as JSONL (in input order) and returns the latency summary
+def runBatch(timetable, queriesPath, outputPath, workers=None, cacheSize=1024, cacheBucket=900):
+    queries = readQueries(queriesPath)
+    with createPool(timetable, workers, cacheSize, cacheBucket) as pool:
+        chunksize = max(1, len(queries) // (4 * (workers or os.cpu_count() or 1)))
+        responses = list(pool.map(batchAnswer, queries, chunksize=chunksize))
+    with open(outputPath, 'w') as file:
+        for query, response in zip(queries, responses):
+            if 'error' in response:
+                response = {**query, **response} if isinstance(query, dict) else {'query': query, **response}
+            file.write(json.dumps(response) + '\n')
+    return latencySummary(responses)
+
+def presentSummary(summary, errors):
+    for mode, stats in sorted(summary.items()):
+        print(f"{mode}: {stats['queries']} queries ({stats['cacheHits']} cache hits), p50 {stats['p50']:.6f}s, p95 {stats['p95']:.6f}s, p99 {stats['p99']:.6f}s")
+    if errors:
+        print(f"{errors} queries failed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', action='store_true', help='answer JSON queries over HTTP instead of reading stdin')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--batch', metavar='QUERIES', help='answer queries from a CSV/JSONL file instead of reading stdin')
+    parser.add_argument('--output', default='results.jsonl', help='where --batch writes its JSONL results')
+    parser.add_argument('--profile', nargs=4, metavar=('START', 'END', 'FROM', 'UNTIL'),
+                        help='print all optimal departures from START to END between FROM and UNTIL (HH:MM)')
+    parser.add_argument('--from-coordinates', nargs=4, metavar=('LAT', 'LON', 'END', 'TIME'),
+                        help='route from the stops nearest to a coordinate to END, leaving at TIME (HH:MM)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-size', type=int, default=1024, help='results cached per worker, 0 disables the cache')
+    parser.add_argument('--cache-bucket', type=int, default=15, help='departure time bucket of the cache in minutes')
+    args = parser.parse_args()
+
+    print('Loading timetable...')
+    loadStats = Stats()
+    mainGraph = loadTimetable(csvPath, cachePath, loadStats)
+    sys.stderr.write(f"Load stats: {loadStats}\n")
+
+    if args.serve:
+        serve(mainGraph, args.host, args.port, args.workers, args.cache_size, args.cache_bucket * 60)
+        sys.exit()
+    if args.profile:
+        startArg, endArg, windowStart, windowEnd = args.profile
+        stats = Stats()
+        with stats.phase('search'):
+            journeys = profileQuery(mainGraph, startArg, endArg, parseTime(windowStart), parseTime(windowEnd), stats)
+        for departureTime, arrivalTime, result in journeys:
+            print(f"Leave at {formatTime(departureTime)}, arrive at {formatTime(arrivalTime)}:")
+            presentResult(result, departureTime, stats.timings['search'], mainGraph, stats)
+            print()
+        sys.exit()
+    if args.from_coordinates:
+        lat, lon, endArg, startTime = args.from_coordinates
+        lat, lon, startTime = float(lat), float(lon), parseTime(startTime)
+        for distance, stop in mainGraph.stopIndex().nearest(lat, lon, 5):
+            print(f"Nearby stop: {mainGraph.stopNames[stop]} ({distance:.0f} m)")
+        stats = Stats()
+        with stats.phase('search'):
+            result = csaFromCoordinates(mainGraph, lat, lon, endArg, startTime, stats=stats)
+        presentResult(result, startTime, stats.timings['search'], mainGraph, stats)
+        sys.exit()
+    if args.batch:
+        presentSummary(*runBatch(mainGraph, args.batch, args.output, args.workers, args.cache_size, args.cache_bucket * 60))
+        sys.exit()
+
+    while True:
+        startArg = input("Input start stop: ")
+        endArg = input("Input end stop: ")
+        hr = int(input("Input hour of arrival at start stop: "))
+        min = int(input("Input minute of arrival at start stop: "))
+        startTimeArg = hr * 3600 + min * 60
+
+
+
+        print()
+        print("Calculating Dijkstra - time...")
+        stats = Stats()
+        with stats.phase('search'):
+            result = dijkstra(mainGraph, startArg, endArg, startTimeArg, stats=stats)
+        presentResult(result, startTimeArg, stats.timings['search'], mainGraph, stats)
+        print()
+
+        print("Calculating CSA - time...")
+        stats = Stats()
+        with stats.phase('search'):
+            result = csa(mainGraph, startArg, endArg, startTimeArg, stats=stats)
+        presentResult(result, startTimeArg, stats.timings['search'], mainGraph, stats)
+        print()
+
+
+        print("Calculating A* - time with haversine heuristic...")
+        stats = Stats()
+        with stats.phase('search'):
+            result = astarTime(mainGraph, startArg, endArg, startTimeArg, stats=stats)
+        presentResult(result, startTimeArg, stats.timings['search'], mainGraph, stats)
+        print()
+
+        print("Calculating RAPTOR - arrival time and transfers...")
+        stats = Stats()
+        with stats.phase('search'):
+            journeys = raptor(mainGraph, startArg, endArg, startTimeArg, stats=stats)
 
-    presentResult(result, startTimeArg, end - start)
-    print()
\ No newline at end of file
+        for transfers, result in journeys:
+            print(f"Journey with {transfers} transfers:")
+            presentResult(result, startTimeArg, stats.timings['search'], mainGraph, stats)
+            print()